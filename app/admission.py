@@ -0,0 +1,384 @@
+"""Admission control: rate limits and concurrency caps checked before routing.
+
+``AdmissionMiddleware`` turns requests away before they reach a thread or a
+database connection, so a spike sheds load quickly instead of queueing
+until every request is slow:
+
+* a global cap on requests in flight in this worker (``503``);
+* per-route concurrency limits, a tight one for ``/users/register`` and
+  ``/users/login`` (bcrypt) and a separate one for calculation writes, which
+  each hold a database connection. Requests over a limit wait in a short
+  queue for a slot, and are turned away once the queue is full (``503``);
+* token buckets per client address and per user, so one caller cannot use
+  up a worker on its own (``429``). The user comes from the access token;
+  anonymous callers, who name any user in the body, share a user bucket
+  per address instead.
+
+Rejections carry ``Retry-After``. ``/health/*`` and ``/metrics`` are never
+limited, so monitoring keeps working during an overload.
+
+The concurrency caps protect this worker's own threadpool and pools, so
+they are always counted in-process. Token buckets live in a
+``RateLimitBackend``: ``memory`` (default) keeps them per worker, so a
+client's real limit is the configured rate times the number of workers;
+``redis`` shares them between workers (``REDIS_URL``, needs the ``redis``
+package). A rate or cap of 0 turns that check off.
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import time
+from collections import deque
+from typing import Optional
+
+import orjson
+
+from sqlalchemy.pool import NullPool
+
+from app import auth, metrics
+from app.database import POOL_MAX_OVERFLOW, POOL_SIZE, async_engine
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "512"))
+# Hashing is the slow part of both routes, so a couple of requests per
+# hashing thread is all that can usefully be in progress.
+ADMISSION_AUTH_CONCURRENCY = int(os.getenv("ADMISSION_AUTH_CONCURRENCY", str(2 * auth.HASH_WORKERS)))
+ADMISSION_AUTH_QUEUE = int(os.getenv("ADMISSION_AUTH_QUEUE", "0"))
+
+
+def _default_write_concurrency() -> int:
+    # Writes beyond what the pool can hold would only wait for a connection.
+    # Without a pool (SQLite) every request opens its own connection and the
+    # database file lock serialises the writes, so a modest cap is enough.
+    if isinstance(async_engine.sync_engine.pool, NullPool):
+        return 32
+    return POOL_SIZE + POOL_MAX_OVERFLOW
+
+
+ADMISSION_WRITE_CONCURRENCY = int(os.getenv("ADMISSION_WRITE_CONCURRENCY") or _default_write_concurrency())
+ADMISSION_WRITE_QUEUE = int(os.getenv("ADMISSION_WRITE_QUEUE", "256"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_USER_RPS = float(os.getenv("RATE_LIMIT_USER_RPS", "500"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "1000"))
+RATE_LIMIT_IP_RPS = float(os.getenv("RATE_LIMIT_IP_RPS", "1000"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "2000"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# How long a verified token's user id is reused without checking it again.
+TOKEN_CACHE_SECONDS = 60.0
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+AUTH_PATHS = frozenset(("/users/register", "/users/login"))
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+EXEMPT_PREFIXES = ("/health", "/metrics")
+
+admission_rejected = metrics.registry.counter(
+    "admission_rejected_total", "Requests turned away by admission control, by reason.", ("reason",))
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """The concurrency limit a request counts against, if any."""
+    if path in AUTH_PATHS:
+        return "auth"
+    if method in WRITE_METHODS and path.startswith("/calculations"):
+        return "write"
+    return None
+
+
+class RateLimitBackend:
+    """Storage for token buckets. ``take`` is awaited from the event loop."""
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token from ``key``'s bucket: 0 when granted, else seconds until one is."""
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        return {}
+
+
+class MemoryBackend(RateLimitBackend):
+    """Token buckets kept in this process.
+
+    Buckets are ``(tokens, updated)`` pairs refilled lazily when touched.
+    The least recently used are dropped past ``max_keys``; a dropped bucket
+    simply starts full again, which only ever errs towards admitting.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+        # Re-inserting keeps the dict in least-recently-used order.
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            wait = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            wait = (1 - tokens) / rate
+        if len(self._buckets) > self.max_keys:
+            del self._buckets[next(iter(self._buckets))]
+        return wait
+
+    def snapshot(self) -> dict:
+        return {"tracked_keys": len(self._buckets), "max_keys": self.max_keys}
+
+
+# Same refill rule as MemoryBackend, timed by the Redis server's clock so
+# every worker agrees. Returns the wait in microseconds (0 when granted).
+_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = burst
+if bucket[1] then
+    tokens = math.min(burst, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return wait
+"""
+
+
+class RedisBackend(RateLimitBackend):
+    """Token buckets shared by every worker through Redis."""
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the 'redis' package installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(_TAKE)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        # Keys hold client addresses, which need not be readable in Redis.
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        wait = await self._take(keys=[self.prefix + digest], args=[rate, burst])
+        return int(wait) / 1_000_000
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {name}")
+
+
+class Rejection(Exception):
+    """Why a request was turned away, and the response to send for it."""
+
+    def __init__(self, reason: str, status: int, retry_after: float, detail: str):
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdmissionController:
+    """Limits and counters for one worker.
+
+    Counters are only touched from the event loop, so they need no locks.
+    Every check that counts a request in runs without an ``await`` between
+    the check and the increment.
+    """
+
+    def __init__(self, enabled: bool = ADMISSION_CONTROL, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 auth_concurrency: int = ADMISSION_AUTH_CONCURRENCY, auth_queue: int = ADMISSION_AUTH_QUEUE,
+                 write_concurrency: int = ADMISSION_WRITE_CONCURRENCY, write_queue: int = ADMISSION_WRITE_QUEUE,
+                 user_rate: float = RATE_LIMIT_USER_RPS, user_burst: float = RATE_LIMIT_USER_BURST,
+                 ip_rate: float = RATE_LIMIT_IP_RPS, ip_burst: float = RATE_LIMIT_IP_BURST,
+                 backend: Optional[RateLimitBackend] = None, max_tokens: int = RATE_LIMIT_MAX_KEYS):
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.limits = {"auth": auth_concurrency, "write": write_concurrency}
+        self.queue_sizes = {"auth": auth_queue, "write": write_queue}
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.backend = backend if backend is not None else create_backend() if enabled else None
+        self.max_tokens = max_tokens
+        self.in_flight = 0
+        self.route_in_flight = {"auth": 0, "write": 0}
+        self.rejected = {"in_flight": 0, "auth": 0, "write": 0, "user_rate": 0, "ip_rate": 0}
+        self._waiters = {"auth": deque(), "write": deque()}
+        self._token_users = {}
+
+    def _user_key(self, scope, address: str) -> str:
+        """Bucket key for the caller: its user id, or its address when anonymous."""
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    user_id = self._token_user(token)
+                    if user_id is not None:
+                        return f"user:{user_id}"
+                break
+        return f"anon:{address}"
+
+    def _token_user(self, token: str) -> Optional[int]:
+        # Checking the signature costs tens of microseconds, so a token's
+        # answer is reused for a while. Expiry is still enforced by the
+        # routes; here a token only has to pick the right bucket.
+        now = time.monotonic()
+        cached = self._token_users.get(token)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        try:
+            user_id = auth.decode_access_token(token)
+        except auth.InvalidToken:
+            user_id = None
+        self._token_users.pop(token, None)
+        self._token_users[token] = (user_id, now + TOKEN_CACHE_SECONDS)
+        if len(self._token_users) > self.max_tokens:
+            del self._token_users[next(iter(self._token_users))]
+        return user_id
+
+    async def admit(self, scope) -> Optional[str]:
+        """Count the request in, returning its route class for ``release``.
+
+        Raises ``Rejection`` when a limit is reached; nothing is counted then.
+        """
+        client = scope.get("client")
+        address = client[0] if client else ""
+        if self.ip_rate:
+            wait = await self.backend.take(f"ip:{address}", self.ip_rate, self.ip_burst)
+            if wait:
+                raise self._rejection("ip_rate", 429, wait, "Too many requests")
+        if self.user_rate:
+            wait = await self.backend.take(self._user_key(scope, address), self.user_rate, self.user_burst)
+            if wait:
+                raise self._rejection("user_rate", 429, wait, "Too many requests")
+
+        # From here to the increments there is no await, so concurrent
+        # requests cannot all pass the same check.
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            raise self._rejection("in_flight", 503, 1, "Server is busy, try again shortly")
+        kind = route_class(scope["method"], scope["path"])
+        if kind is None or not self.limits[kind] or self.route_in_flight[kind] < self.limits[kind]:
+            self.in_flight += 1
+            if kind is not None:
+                self.route_in_flight[kind] += 1
+            return kind
+
+        waiters = self._waiters[kind]
+        if len(waiters) >= self.queue_sizes[kind]:
+            raise self._rejection(kind, 503, 1, "Too many requests in progress, try again shortly")
+        self.in_flight += 1
+        slot = asyncio.get_running_loop().create_future()
+        waiters.append(slot)
+        try:
+            # ``release`` hands its route slot straight to the next waiter.
+            await slot
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                self.release(kind)
+            else:
+                waiters.remove(slot)
+                self.in_flight -= 1
+            raise
+        return kind
+
+    def release(self, kind: Optional[str]) -> None:
+        self.in_flight -= 1
+        if kind is None:
+            return
+        waiters = self._waiters[kind]
+        while waiters:
+            slot = waiters.popleft()
+            if not slot.done():
+                slot.set_result(None)
+                return
+        self.route_in_flight[kind] -= 1
+
+    def _rejection(self, reason: str, status: int, retry_after: float, detail: str) -> Rejection:
+        self.rejected[reason] += 1
+        admission_rejected.inc(reason)
+        return Rejection(reason, status, retry_after, detail)
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "route_in_flight": dict(self.route_in_flight),
+            "route_limits": dict(self.limits),
+            "route_queued": {kind: len(waiters) for kind, waiters in self._waiters.items()},
+            "route_queue_sizes": dict(self.queue_sizes),
+            "rejected": dict(self.rejected),
+            "rate_limits": {
+                "user": {"rate": self.user_rate, "burst": self.user_burst},
+                "ip": {"rate": self.ip_rate, "burst": self.ip_burst},
+            },
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            **(self.backend.snapshot() if self.backend is not None else {}),
+        }
+
+
+controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware that answers over-limit requests itself."""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self._controller = controller
+
+    @property
+    def controller(self) -> AdmissionController:
+        # Looked up per request when not given, so tests can swap the
+        # module-level controller.
+        return self._controller if self._controller is not None else controller
+
+    async def __call__(self, scope, receive, send):
+        admission = self.controller
+        if not admission.enabled or scope["type"] != "http" or scope["path"].startswith(EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            kind = await admission.admit(scope)
+        except Rejection as rejection:
+            body = orjson.dumps({"detail": rejection.detail})
+            await send({
+                "type": "http.response.start",
+                "status": rejection.status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(rejection.retry_after))).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(kind)
+
+
+def _metrics():
+    return [
+        metrics.family("admission_in_flight", "gauge", "Requests admitted and still in progress.",
+                       [["admission_in_flight", {}, controller.in_flight]]),
+    ]
+
+
+metrics.registry.register_collector(_metrics)
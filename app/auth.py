@@ -1,6 +1,39 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from jose import JWTError, jwt
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app import profiling
+from app.metrics import Histogram
+
+# bcrypt work factor; each +1 doubles the cost of a hash.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt releases the GIL, so a thread pool gives real parallelism without
+# the pickling overhead of a process pool.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "32"))
+
+# Access tokens are HMAC-signed, so checking one costs microseconds instead of
+# a bcrypt verification. Anyone who knows the key can sign a token for any
+# user, so a built-in key is only used when APP_ENV says this is a
+# development or test setup; anywhere else startup fails without one.
+APP_ENV = os.getenv("APP_ENV", "production").lower()
+DEV_ENVIRONMENTS = ("development", "dev", "test")
+DEV_JWT_SECRET_KEY = "dev-secret-change-me"
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY") or (DEV_JWT_SECRET_KEY if APP_ENV in DEV_ENVIRONMENTS else None)
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Legacy mode: calculation routes accept requests without a token and trust
+# the user_id they name. Anyone can then act as any user, so it is off
+# unless explicitly turned on.
+ANONYMOUS_CALCULATIONS = os.getenv("ANONYMOUS_CALCULATIONS", "false").lower() in ("1", "true", "yes")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 # Bcrypt has a 72-byte limit, so we truncate if needed
 MAX_PASSWORD_LENGTH = 72
@@ -16,3 +49,98 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     # Truncate password to bcrypt's 72-byte limit
     password_bytes = plain_password.encode('utf-8')[:MAX_PASSWORD_LENGTH]
     return pwd_context.verify(password_bytes.decode('utf-8'), hashed_password)
+
+
+class HashQueueFull(Exception):
+    """Raised when the hashing executor has no room for another job."""
+
+
+class HashExecutor:
+    """Dedicated, bounded executor for password hashing.
+
+    At most ``workers`` hashes run at once and at most ``queue_size`` more may
+    wait; anything beyond that is rejected immediately with ``HashQueueFull``
+    rather than queueing behind the rest of the application's work.
+    ``submit`` must be awaited from the event loop, which is what keeps the
+    bookkeeping here free of locks.
+    """
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_size: int = HASH_QUEUE_SIZE):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.pending = 0
+        self.rejected = 0
+        self.wait_latency = Histogram()
+        self.hash_latency = Histogram()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+
+    def _timed(self, submitted: float, func, *args):
+        started = time.perf_counter()
+        self.wait_latency.observe(started - submitted)
+        try:
+            return func(*args)
+        finally:
+            self.hash_latency.observe(time.perf_counter() - started)
+
+    async def submit(self, func, *args):
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise HashQueueFull()
+
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, submitted, func, *args)
+        finally:
+            self.pending -= 1
+            profiling.record_hash_time(time.perf_counter() - submitted)
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "queue_depth": self.pending,
+            "rejected": self.rejected,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "wait_latency_seconds": self.wait_latency.snapshot(),
+            "hash_latency_seconds": self.hash_latency.snapshot(),
+        }
+
+
+hash_executor = HashExecutor()
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hash_executor.submit(get_password_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hash_executor.submit(verify_password, plain_password, hashed_password)
+
+
+class InvalidToken(Exception):
+    """Raised when an access token is malformed, forged or expired."""
+
+
+def check_settings() -> None:
+    """Refuse to start without a signing key; called from the application lifespan."""
+    if not JWT_SECRET_KEY:
+        raise RuntimeError(
+            "JWT_SECRET_KEY is not set. Set it to a long random value, or set "
+            "APP_ENV=development to use the built-in development key."
+        )
+
+
+def create_access_token(user_id: int) -> str:
+    expires = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode({"sub": str(user_id), "exp": expires}, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def decode_access_token(token: str) -> int:
+    """Return the user id the token was issued to."""
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        return int(claims["sub"])
+    except (JWTError, KeyError, ValueError):
+        raise InvalidToken()
@@ -0,0 +1,241 @@
+"""Read cache for calculations by id.
+
+Entries hold the serialized ``CalculationRead`` JSON and are dropped when a
+calculation is edited or deleted. Backends:
+
+* ``memory``: a bounded LRU with a TTL inside each worker. With several
+  workers an edit only clears the worker that served it, so other workers
+  may serve the old row until the TTL runs out. It is therefore the default
+  only for a single worker (``WEB_CONCURRENCY``, which ``app.server`` sets).
+* ``redis``: one cache shared by every worker (``REDIS_URL``), so an edit
+  clears it for all of them. Needs the ``redis`` package.
+* ``off``: no caching, the default with more than one worker.
+
+Every key has a version that invalidation bumps. A reader notes the version
+before it queries the database and only stores its row if the version is
+unchanged, so a read that raced with an edit cannot put the old row back.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app import metrics
+
+
+def default_backend_name(environ=os.environ) -> str:
+    if environ.get("CALCULATION_CACHE"):
+        return environ["CALCULATION_CACHE"].lower()
+    return "memory" if int(environ.get("WEB_CONCURRENCY") or "1") <= 1 else "off"
+
+
+CALCULATION_CACHE = default_backend_name()
+CALCULATION_CACHE_SIZE = int(os.getenv("CALCULATION_CACHE_SIZE", "10000"))
+CALCULATION_CACHE_TTL = float(os.getenv("CALCULATION_CACHE_TTL", "30"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class CacheBackend:
+    """Storage for cached values. All methods are awaited from the event loop."""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def version(self, key: str) -> int:
+        """Current version of ``key``; pass it to ``set_if_version``."""
+        raise NotImplementedError
+
+    async def set_if_version(self, key: str, value: bytes, version: int) -> bool:
+        """Store ``value`` unless ``key`` was invalidated since ``version`` was read."""
+        raise NotImplementedError
+
+    async def invalidate(self, key: str) -> None:
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """LRU with a TTL, kept in this process.
+
+    Sharing one instance between several ``CalculationCache`` objects stands
+    in for a shared backend in tests.
+    """
+
+    def __init__(self, max_entries: int = CALCULATION_CACHE_SIZE, ttl: float = CALCULATION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def version(self, key: str) -> int:
+        return self._versions.get(key, 0)
+
+    async def set_if_version(self, key: str, value: bytes, version: int) -> bool:
+        if self._versions.get(key, 0) != version:
+            return False
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    async def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._versions[key] = self._versions.pop(key, 0) + 1
+        # A version only has to outlive reads already in flight, so keep
+        # the most recent ones and let the rest fall back to 0.
+        while len(self._versions) > self.max_entries:
+            self._versions.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Store the value only if the version key still holds the version the
+# reader saw (a missing version key counts as 0).
+_SET_IF_VERSION = """
+local current = redis.call('GET', KEYS[2]) or '0'
+if current ~= ARGV[2] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+return 1
+"""
+
+
+class RedisBackend(CacheBackend):
+    """Cache shared by every worker through Redis.
+
+    Redis enforces the size bound with its own eviction policy
+    (``maxmemory-policy allkeys-lru``), so evictions are reported there.
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = CALCULATION_CACHE_TTL, prefix: str = "calc:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CALCULATION_CACHE=redis needs the 'redis' package installed")
+        self.client = redis.Redis.from_url(url)
+        self.ttl_ms = int(ttl * 1000)
+        self.prefix = prefix
+        self._set_if_version = self.client.register_script(_SET_IF_VERSION)
+
+    def _keys(self, key: str):
+        return f"{self.prefix}{key}", f"{self.prefix}{key}:version"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self._keys(key)[0])
+
+    async def version(self, key: str) -> int:
+        return int(await self.client.get(self._keys(key)[1]) or 0)
+
+    async def set_if_version(self, key: str, value: bytes, version: int) -> bool:
+        stored = await self._set_if_version(keys=self._keys(key), args=[value, version, self.ttl_ms])
+        return bool(stored)
+
+    async def invalidate(self, key: str) -> None:
+        value_key, version_key = self._keys(key)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(version_key)
+            pipe.pexpire(version_key, self.ttl_ms)
+            pipe.delete(value_key)
+            await pipe.execute()
+
+
+class CalculationCache:
+    """Cache front end that counts this worker's hits and misses."""
+
+    def __init__(self, backend: Optional[CacheBackend]):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get(self, calculation_id: int) -> Optional[bytes]:
+        value = await self.backend.get(str(calculation_id))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def version(self, calculation_id: int) -> int:
+        return await self.backend.version(str(calculation_id))
+
+    async def fill(self, calculation_id: int, value: bytes, version: int) -> bool:
+        return await self.backend.set_if_version(str(calculation_id), value, version)
+
+    async def invalidate(self, calculation_id: int) -> None:
+        if self.backend is not None:
+            self.invalidations += 1
+            await self.backend.invalidate(str(calculation_id))
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            **(self.backend.snapshot() if self.backend is not None else {}),
+        }
+
+
+def create_backend(name: str = CALCULATION_CACHE) -> Optional[CacheBackend]:
+    if name == "off":
+        return None
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown CALCULATION_CACHE backend: {name}")
+
+
+calculation_cache = CalculationCache(create_backend())
+
+
+def _metrics():
+    snapshot = calculation_cache.snapshot()
+    families = [
+        metrics.family("calculation_cache_hits_total", "counter", "Calculation reads served from the cache.",
+                       [["calculation_cache_hits_total", {}, snapshot["hits"]]]),
+        metrics.family("calculation_cache_misses_total", "counter", "Calculation reads that went to the database.",
+                       [["calculation_cache_misses_total", {}, snapshot["misses"]]]),
+    ]
+    if "evictions" in snapshot:
+        families.append(metrics.family(
+            "calculation_cache_evictions_total", "counter", "Entries evicted to stay within the size bound.",
+            [["calculation_cache_evictions_total", {}, snapshot["evictions"]]]))
+    return families
+
+
+metrics.registry.register_collector(_metrics)
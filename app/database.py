@@ -1,7 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from dotenv import load_dotenv
+import logging
 import os
+import time
+
+from app import profiling
+from app.metrics import Histogram
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,13 +20,262 @@ DATABASE_URL = os.getenv(
     "sqlite:///./calculator.db",
 )
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+# Async drivers for each backend: asyncpg for PostgreSQL, aiosqlite for SQLite.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+# Connection pool tuning. The sizes apply per engine and per worker process.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Connections each engine opens at startup, capped at the pool size. The first
+# one also runs the dialect's first-connect setup, which would otherwise land
+# on the first request.
+POOL_WARM = int(os.getenv("DB_POOL_WARM", "1"))
+# "null" makes the async engines open a connection per checkout instead of
+# pooling. asyncpg and aiosqlite connections are bound to the event loop that
+# opened them, so this is for callers that run requests on more than one
+# loop, such as the test suite's TestClient.
+ASYNC_POOL = os.getenv("DB_ASYNC_POOL", "queue").lower()
+
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.get_backend_name()}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+# Comma-separated read replicas of DATABASE_URL, used by the GET routes.
+REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# After a write, that client's reads stay on the primary for this long so
+# they see their own changes despite replication lag.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# A replica that fails to connect is skipped for this long.
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+logger = logging.getLogger("app.database")
+
+
+class PoolStats:
+    """Counters and checkout latency for one engine's connection pool."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.checkout_latency = Histogram()
+
+    def attach(self, sync_engine) -> None:
+        self.engine = sync_engine
+        event.listen(sync_engine, "connect", self._on_connect)
+        event.listen(sync_engine, "checkout", self._on_checkout)
+        event.listen(sync_engine, "checkin", self._on_checkin)
+        event.listen(sync_engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.invalidations += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        latency = self.checkout_latency.snapshot()
+        stats = {
+            "pool": type(pool).__name__,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "invalidations": self.invalidations,
+            "checkout_wait_seconds_total": latency["sum"],
+            "checkout_latency_seconds": latency,
+        }
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+            )
+        return stats
+
+
+def _timed_pool_class(base, stats: PoolStats):
+    """Subclass ``base`` so that the time spent obtaining a connection lands in
+    ``stats.checkout_latency``. The subclass survives ``engine.dispose()``,
+    which recreates the pool from its class."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return base._do_get(self)
+        finally:
+            stats.checkout_latency.observe(time.perf_counter() - start)
+
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get})
+
+
+def _pool_options(url: str, stats: PoolStats, is_async: bool) -> dict:
+    options = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    parsed = make_url(url)
+    sqlite = parsed.get_backend_name() == "sqlite"
+    if sqlite and parsed.database in (None, "", ":memory:"):
+        # In-memory databases need the dialect's single-connection pools.
+        return options
+    if is_async and (sqlite or ASYNC_POOL == "null"):
+        # SQLite connects are cheap, so aiosqlite connections, which are
+        # bound to the event loop that opened them, are never pooled.
+        options["poolclass"] = _timed_pool_class(NullPool, stats)
+        return options
+
+    options.update(
+        poolclass=_timed_pool_class(AsyncAdaptedQueuePool if is_async else QueuePool, stats),
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+    )
+    return options
+
+
+pool_stats = {"sync": PoolStats("sync"), "async": PoolStats("async")}
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+    **_pool_options(DATABASE_URL, pool_stats["sync"], is_async=False),
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **_pool_options(ASYNC_DATABASE_URL, pool_stats["async"], is_async=True),
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+pool_stats["sync"].attach(engine)
+pool_stats["async"].attach(async_engine.sync_engine)
+profiling.instrument_engine(engine)
+profiling.instrument_engine(async_engine.sync_engine)
+
+
+class ReplicaRouter:
+    """Chooses the engine for a read-only session.
+
+    Reads rotate over the replicas, except for clients that wrote within the
+    last ``sticky_seconds`` (tracked by key: a user id or client address),
+    which read from the primary. A replica that cannot be reached is left
+    out for ``retry_seconds`` and the read falls back to the next replica or
+    the primary. All state is touched only from the event loop.
+    """
+
+    def __init__(self, primary, replica_urls, sticky_seconds: float = READ_YOUR_WRITES_SECONDS,
+                 retry_seconds: float = REPLICA_RETRY_SECONDS):
+        self.primary = primary
+        self.replicas = []
+        for index, url in enumerate(replica_urls):
+            async_url = to_async_url(url)
+            stats = pool_stats.setdefault(f"replica{index}", PoolStats(f"replica{index}"))
+            replica = create_async_engine(async_url, **_pool_options(async_url, stats, is_async=True))
+            stats.attach(replica.sync_engine)
+            profiling.instrument_engine(replica.sync_engine)
+            self.replicas.append(replica)
+        self.sticky_seconds = sticky_seconds
+        self.retry_seconds = retry_seconds
+        self.primary_reads = 0
+        self.replica_reads = [0] * len(self.replicas)
+        self.fallbacks = 0
+        self._turn = 0
+        self._down_until = [0.0] * len(self.replicas)
+        self._recent_writes = {}
+
+    def note_write(self, key) -> None:
+        now = time.monotonic()
+        if len(self._recent_writes) > 10000:
+            self._recent_writes = {k: until for k, until in self._recent_writes.items() if until > now}
+        self._recent_writes[key] = now + self.sticky_seconds
+
+    def _candidates(self, key):
+        now = time.monotonic()
+        if self._recent_writes.get(key, 0.0) > now:
+            return
+        count = len(self.replicas)
+        start, self._turn = self._turn, (self._turn + 1) % max(count, 1)
+        for offset in range(count):
+            index = (start + offset) % count
+            if self._down_until[index] <= now:
+                yield index
+
+    async def session(self, key) -> AsyncSession:
+        for index in self._candidates(key):
+            db = AsyncSessionLocal(bind=self.replicas[index])
+            try:
+                # Connect now so an unreachable replica is caught here
+                # rather than in the middle of the endpoint.
+                await db.connection()
+            except (SQLAlchemyError, OSError) as e:
+                await db.close()
+                self._down_until[index] = time.monotonic() + self.retry_seconds
+                self.fallbacks += 1
+                logger.warning("Replica %d is unavailable, skipping it for %ss: %s", index, self.retry_seconds, e)
+                continue
+            self.replica_reads[index] += 1
+            return db
+        self.primary_reads += 1
+        return AsyncSessionLocal(bind=self.primary)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "replicas": len(self.replicas),
+            "primary_reads": self.primary_reads,
+            "replica_reads": self.replica_reads,
+            "fallbacks": self.fallbacks,
+            "down": [index for index, until in enumerate(self._down_until) if until > now],
+            "sticky_clients": sum(1 for until in self._recent_writes.values() if until > now),
+        }
+
+
+read_router = ReplicaRouter(async_engine, REPLICA_URLS)
+
+
+def warm_sync_pool(count: int = POOL_WARM) -> None:
+    connections = [engine.connect() for _ in range(min(count, POOL_SIZE))]
+    for connection in connections:
+        connection.close()
+
+
+async def warm_async_pool(count: int = POOL_WARM) -> None:
+    connections = [await async_engine.connect() for _ in range(min(count, POOL_SIZE))]
+    for connection in connections:
+        await connection.close()
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
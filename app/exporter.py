@@ -0,0 +1,137 @@
+"""Streaming export of calculations as NDJSON, CSV or Arrow IPC."""
+
+import csv
+import io
+import os
+import zlib
+
+import orjson
+
+FORMATS = ("ndjson", "csv", "arrow")
+DEFAULT_CHUNK_SIZE = 5000
+GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+COLUMNS = ("id", "operation", "operand_a", "operand_b", "result", "user_id", "created_at")
+
+
+class NdjsonEncoder:
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows) -> bytes:
+        return b"".join(orjson.dumps(row._asdict(), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class CsvEncoder:
+    media_type = "text/csv; charset=utf-8"
+    extension = "csv"
+
+    def _write(self, rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def header(self) -> bytes:
+        return self._write([COLUMNS])
+
+    def encode(self, rows) -> bytes:
+        return self._write(
+            (row.id, row.operation, row.operand_a, row.operand_b, row.result, row.user_id,
+             row.created_at.isoformat() if row.created_at is not None else "")
+            for row in rows
+        )
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class _Chunks:
+    """File-like sink that hands back whatever was written since the last take."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+class ArrowEncoder:
+    """Arrow IPC stream: one record batch per chunk, readable with ``pyarrow.ipc.open_stream``."""
+
+    media_type = "application/vnd.apache.arrow.stream"
+    extension = "arrows"
+
+    def __init__(self):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("id", pa.int64()),
+            ("operation", pa.string()),
+            ("operand_a", pa.float64()),
+            ("operand_b", pa.float64()),
+            ("result", pa.float64()),
+            ("user_id", pa.int64()),
+            ("created_at", pa.timestamp("us")),
+        ])
+        self._sink = _Chunks()
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def header(self) -> bytes:
+        return self._sink.take()
+
+    def encode(self, rows) -> bytes:
+        columns = list(zip(*rows))
+        self._writer.write_batch(self.pa.record_batch(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+        return self._sink.take()
+
+    def footer(self) -> bytes:
+        self._writer.close()
+        return self._sink.take()
+
+
+ENCODERS = {"ndjson": NdjsonEncoder, "csv": CsvEncoder, "arrow": ArrowEncoder}
+
+
+def encoder_for(fmt: str):
+    """Raises ValueError for an unknown format and ImportError when Arrow is unavailable."""
+    if fmt not in ENCODERS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return ENCODERS[fmt]()
+
+
+async def encode_stream(partitions, encoder, gzip: bool = False):
+    """Turn an async iterator of row lists into encoded (and optionally gzipped) chunks."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if gzip else None
+
+    def emit(data: bytes, final: bool = False) -> bytes:
+        if compressor is None:
+            return data
+        # A sync flush after every chunk lets the client decode each one as
+        # it arrives instead of waiting for the compressor's window to fill.
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    yield emit(encoder.header())
+    async for rows in partitions:
+        if rows:
+            yield emit(encoder.encode(rows))
+    yield emit(encoder.footer(), final=True)
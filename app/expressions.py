@@ -0,0 +1,92 @@
+"""Safe arithmetic expressions compiled to Python closures.
+
+Expressions such as ``(a + b) * c / d`` are parsed with :mod:`ast`, checked
+against a whitelist of node types and turned into a tree of closures over the
+functions in :mod:`app.operations`. Nothing is ever passed to ``eval``.
+Compiled plans are cached by expression text, so repeated formulas skip
+parsing entirely.
+"""
+
+import ast
+import os
+from functools import lru_cache
+from typing import Callable, Dict, Tuple
+
+import app.operations as op
+
+MAX_EXPRESSION_LENGTH = 1000
+PLAN_CACHE_SIZE = int(os.getenv("EXPRESSION_CACHE_SIZE", "1024"))
+
+BINARY_OPERATORS = {
+    ast.Add: op.add,
+    ast.Sub: op.subtract,
+    ast.Mult: op.multiply,
+    ast.Div: op.divide,
+}
+
+
+class ExpressionError(ValueError):
+    """Raised when an expression cannot be parsed or uses unsupported syntax."""
+
+
+class CompiledExpression:
+    """A parsed, validated expression ready to be evaluated many times."""
+
+    def __init__(self, text: str, evaluate: Callable[[Dict[str, float]], float], variables: Tuple[str, ...]):
+        self.text = text
+        self.variables = variables
+        self._evaluate = evaluate
+
+    def __call__(self, bindings: Dict[str, float]) -> float:
+        missing = [name for name in self.variables if name not in bindings]
+        if missing:
+            raise ValueError(f"Missing value for variable(s): {', '.join(missing)}")
+        return self._evaluate(bindings)
+
+
+def _constant(value: float):
+    return lambda bindings: value
+
+
+def _compile_node(node: ast.AST, variables: set):
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return _constant(float(node.value))
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        variables.add(name)
+        return lambda bindings: bindings[name]
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        operand = _compile_node(node.operand, variables)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        return lambda bindings: -operand(bindings)
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        func = BINARY_OPERATORS[type(node.op)]
+        left = _compile_node(node.left, variables)
+        right = _compile_node(node.right, variables)
+        return lambda bindings: func(left(bindings), right(bindings))
+
+    raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def compile_expression(text: str) -> CompiledExpression:
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"Expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+        variables = set()
+        evaluate = _compile_node(tree.body, variables)
+    except SyntaxError as e:
+        raise ExpressionError(f"Invalid expression: {e.msg}")
+    except RecursionError:
+        raise ExpressionError("Expression is nested too deeply")
+    except ExpressionError:
+        raise
+    except (OverflowError, ValueError) as e:
+        # A literal too large for a float, for instance.
+        raise ExpressionError(f"Invalid expression: {e}")
+    return CompiledExpression(text, evaluate, tuple(sorted(variables)))
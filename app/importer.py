@@ -0,0 +1,180 @@
+"""Streaming bulk import of calculations from NDJSON or CSV."""
+
+import csv
+import io
+import json
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+import app.operations as op
+from app import models, schemas, stats
+
+FORMATS = ("ndjson", "csv")
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_REJECTIONS = 100
+
+COPY_COLUMNS = ("operation", "operand_a", "operand_b", "result", "user_id", "created_at")
+
+
+class CalculationImporter:
+    """Incrementally parse, validate and write calculation rows.
+
+    Feed raw bytes as they arrive with ``feed`` and call ``finish`` at the end
+    of the input. At most one chunk of rows is held in memory at a time; each
+    full chunk is validated against the users table with a single query and
+    written in its own transaction using the fastest path the backend has.
+
+    With ``owner_id`` (the caller's token) every row belongs to that user:
+    rows may leave ``user_id`` out, and rows naming someone else are rejected.
+    """
+
+    def __init__(self, db: Session, fmt: str = "ndjson", chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 owner_id: Optional[int] = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported import format: {fmt}")
+        self.db = db
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.owner_id = owner_id
+        self.imported = 0
+        self.rejected = 0
+        self.rejections = []
+        self.operation_counts = Counter()
+        self._started = time.perf_counter()
+        self._buffer = b""
+        self._line_number = 0
+        self._header = None
+        self._pending = []
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            self._parse_line(line)
+
+    def finish(self) -> schemas.ImportReport:
+        if self._buffer:
+            self._parse_line(self._buffer)
+            self._buffer = b""
+        self._flush()
+        elapsed = time.perf_counter() - self._started
+        return schemas.ImportReport(
+            imported=self.imported,
+            rejected=self.rejected,
+            rejections=self.rejections,
+            elapsed_seconds=round(elapsed, 6),
+            rows_per_second=round(self.imported / elapsed, 1) if elapsed > 0 else 0.0,
+        )
+
+    def _reject(self, line_number: int, detail: str) -> None:
+        self.rejected += 1
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            self.rejections.append(schemas.ImportRejection(line=line_number, detail=detail))
+
+    def _parse_line(self, line: bytes) -> None:
+        self._line_number += 1
+        text = line.decode("utf-8", errors="replace").strip()
+        if not text:
+            return
+
+        try:
+            if self.fmt == "ndjson":
+                raw = json.loads(text)
+                if not isinstance(raw, dict):
+                    raise ValueError("Expected a JSON object")
+            else:
+                values = next(csv.reader([text]))
+                if self._header is None:
+                    self._header = [name.strip() for name in values]
+                    return
+                raw = dict(zip(self._header, values))
+                if not raw.get("created_at"):
+                    raw.pop("created_at", None)
+            row = schemas.CalculationImportRow.model_validate(raw)
+        except ValidationError as e:
+            error = e.errors()[0]
+            location = ".".join(str(part) for part in error["loc"])
+            self._reject(self._line_number, f"{location}: {error['msg']}" if location else error["msg"])
+            return
+        except ValueError as e:
+            self._reject(self._line_number, str(e))
+            return
+
+        if self.owner_id is not None:
+            if row.user_id is not None and row.user_id != self.owner_id:
+                self._reject(self._line_number, "Cannot act on behalf of another user")
+                return
+            row.user_id = self.owner_id
+        elif row.user_id is None:
+            self._reject(self._line_number, "user_id: Field required")
+            return
+
+        self._pending.append((self._line_number, row))
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+
+        user_ids = {row.user_id for _, row in pending}
+        known_users = set(self.db.scalars(select(models.User.id).where(models.User.id.in_(user_ids))))
+
+        now = datetime.utcnow()
+        rows = []
+        for line_number, row in pending:
+            if row.user_id not in known_users:
+                self._reject(line_number, "User not found")
+                continue
+            try:
+                result = op.calculate(row.operation, row.operand_a, row.operand_b)
+            except ValueError as e:
+                self._reject(line_number, str(e))
+                continue
+            rows.append({
+                "operation": row.operation,
+                "operand_a": row.operand_a,
+                "operand_b": row.operand_b,
+                "result": result,
+                "user_id": row.user_id,
+                "created_at": row.created_at or now,
+            })
+
+        if rows:
+            dialect_name = self.db.get_bind().dialect.name
+            if dialect_name == "postgresql":
+                self._copy_rows(rows)
+            else:
+                self.db.execute(insert(models.Calculation), rows)
+
+            delta = stats.StatsDelta()
+            for row in rows:
+                delta.add(row["user_id"], row["operation"], row["result"])
+            self.db.execute(delta.statement(dialect_name))
+            self.db.commit()
+            self.imported += len(rows)
+            self.operation_counts.update(row["operation"] for row in rows)
+
+    def _copy_rows(self, rows) -> None:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[column] for column in COPY_COLUMNS])
+        buffer.seek(0)
+
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {models.Calculation.__tablename__} ({', '.join(COPY_COLUMNS)}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
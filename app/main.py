@@ -1,15 +1,117 @@
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import HTMLResponse
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+import orjson
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import Float, and_, case, delete, insert, literal, select, tuple_, update
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
 
 import app.operations as op
-from app import models, schemas, auth
-from app.database import Base, engine, get_db
+from app import (
+    models, schemas, admission, auth, cache, database, expressions, exporter, importer, metrics, profiling, stats,
+    write_behind,
+)
+from app.database import get_db, get_async_db, pool_stats, warm_async_pool, warm_sync_pool
+
+logger = logging.getLogger("app.startup")
+
+# Filled in by the lifespan handler and served at /health/startup.
+startup_report = {}
+
+
+def _process_age() -> Optional[float]:
+    """Seconds since this process started, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/stat") as stat:
+            started_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            system_uptime = float(uptime.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return system_uptime - started_ticks / os.sysconf("SC_CLK_TCK")
 
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="FastAPI Calculator - Module 12")
+def _warm_up_modules() -> None:
+    # passlib loads its bcrypt backend and python-jose its crypto backend on
+    # first use; do both before the first login rather than during it.
+    auth.pwd_context.handler("bcrypt").get_backend()
+    auth.decode_access_token(auth.create_access_token(0))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is managed by init_db.py, not here: running DDL checks in
+    # every worker at boot slows rollouts and loads the database.
+    auth.check_settings()
+    started = time.perf_counter()
+    _warm_up_modules()
+    try:
+        await run_in_threadpool(warm_sync_pool)
+        await warm_async_pool()
+        pools_warmed = True
+    except (SQLAlchemyError, OSError) as e:
+        # Not fatal: pre-ping and the pool's own retries cover a database
+        # that comes up after the application.
+        logger.warning("Could not warm the connection pools: %s", e)
+        pools_warmed = False
+
+    age = _process_age()
+    startup_report.update(
+        pid=os.getpid(),
+        warmup_ms=round((time.perf_counter() - started) * 1000, 3),
+        ready_after_ms=round(age * 1000, 3) if age is not None else None,
+        pools_warmed=pools_warmed,
+    )
+    logger.info(json.dumps(startup_report))
+    if write_behind.WRITE_BEHIND:
+        await write_behind.writer.start()
+    try:
+        yield
+    finally:
+        await write_behind.writer.stop()
+
+
+app = FastAPI(title="FastAPI Calculator - Module 12", lifespan=lifespan)
+app.router.route_class = profiling.ProfiledRoute
+app.add_middleware(profiling.ProfilingMiddleware)
+# Inside the metrics middleware, so rejected requests are still counted.
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.exception_handler(auth.HashQueueFull)
+async def hash_queue_full_handler(request: Request, exc: auth.HashQueueFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Authentication service is busy, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(write_behind.QueueFull)
+async def write_queue_full_handler(request: Request, exc: write_behind.QueueFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many pending writes, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -124,160 +226,851 @@ def read_root():
     return html_content
 
 
-def _calc(func, a: float, b: float) -> float:
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+RESULT_CACHE_CONTROL = "public, max-age=86400, immutable"
+
+
+# The /api/* results are pure functions of (operation, a, b), so they can be
+# memoized here and cached by browsers and CDNs indefinitely.
+@lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _cached_calculate(operation: str, a: float, b: float) -> float:
+    return op.calculate(operation, a, b)
+
+
+def _calc(operation: str, a: float, b: float) -> float:
     try:
-        return func(a, b)
+        return _cached_calculate(operation, a, b)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception:
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def _result_etag(operation: str, a: float, b: float) -> str:
+    digest = hashlib.blake2b(f"{operation}:{a!r}:{b!r}".encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def _cached_result_response(request: Request, operation: str, a: float, b: float) -> Response:
+    # Computed (from the LRU cache) before the conditional check, so an input
+    # that has no representation, such as division by zero, is still a 400
+    # and never a 304, even for "If-None-Match: *".
+    result = _calc(operation, a, b)
+    headers = {
+        "ETag": _result_etag(operation, a, b),
+        "Cache-Control": RESULT_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"operation": operation, "result": result}, headers=headers)
+
+
 @app.get("/api/add")
-def add(a: float, b: float):
-    return {"operation": "add", "result": _calc(op.add, a, b)}
+def add(request: Request, a: float, b: float):
+    return _cached_result_response(request, "add", a, b)
 
 
 @app.get("/api/subtract")
-def subtract(a: float, b: float):
-    return {"operation": "subtract", "result": _calc(op.subtract, a, b)}
+def subtract(request: Request, a: float, b: float):
+    return _cached_result_response(request, "subtract", a, b)
 
 
 @app.get("/api/multiply")
-def multiply(a: float, b: float):
-    return {"operation": "multiply", "result": _calc(op.multiply, a, b)}
+def multiply(request: Request, a: float, b: float):
+    return _cached_result_response(request, "multiply", a, b)
 
 
 @app.get("/api/divide")
-def divide(a: float, b: float):
-    return {"operation": "divide", "result": _calc(op.divide, a, b)}
+def divide(request: Request, a: float, b: float):
+    return _cached_result_response(request, "divide", a, b)
 
 
-@app.post("/users/register", response_model=schemas.UserRead, status_code=201)
-def register_user(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing_email = db.query(models.User).filter(models.User.email == user_in.email).first()
-    if existing_email:
-        raise HTTPException(status_code=400, detail="Email already registered")
+@app.get("/health/result-cache")
+def result_cache_health():
+    info = _cached_calculate.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+
+
+@app.post("/api/vector", response_model=schemas.VectorResult)
+def vector(request: schemas.VectorRequest):
+    operations = request.operation if request.operation is not None else request.operations
+    try:
+        results, errors = op.vector_calculate(operations, request.a, request.b)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Build the body directly: validating a million floats through the
+    # response model would cost far more than computing them.
+    values = results.tolist()
+    error_items = []
+    for index in np.flatnonzero(errors).tolist():
+        values[index] = None
+        error_items.append({"index": index, "detail": op.VECTOR_ERROR_MESSAGES[int(errors[index])]})
+    return JSONResponse({"results": values, "errors": error_items})
+
+
+@app.post("/api/evaluate", response_model=schemas.EvaluateResult)
+def evaluate(request: schemas.EvaluateRequest):
+    try:
+        plan = expressions.compile_expression(request.expression)
+    except expressions.ExpressionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    results = []
+    errors = []
+    for index, bindings in enumerate(request.bindings):
+        try:
+            value = plan(bindings)
+        except ValueError as e:
+            results.append(None)
+            errors.append(schemas.BatchItemError(index=index, detail=str(e)))
+            continue
+        if not math.isfinite(value):
+            results.append(None)
+            errors.append(schemas.BatchItemError(index=index, detail="Result is not a finite number"))
+            continue
+        results.append(value)
+
+    return schemas.EvaluateResult(
+        expression=request.expression,
+        variables=list(plan.variables),
+        results=results,
+        errors=errors,
+    )
 
-    existing_username = db.query(models.User).filter(models.User.username == user_in.username).first()
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Username already taken")
 
-    hashed_password = auth.get_password_hash(user_in.password)
-    user = models.User(
-        email=user_in.email,
-        username=user_in.username,
-        hashed_password=hashed_password,
+@app.get("/health/startup")
+def startup_health():
+    return startup_report
+
+
+@app.get("/health/pool")
+def pool_health():
+    return {name: stats.snapshot() for name, stats in pool_stats.items()}
+
+
+@app.get("/health/hashing")
+def hashing_health():
+    return auth.hash_executor.snapshot()
+
+
+@app.get("/health/calculation-cache")
+def calculation_cache_health():
+    return cache.calculation_cache.snapshot()
+
+
+@app.get("/health/replicas")
+def replica_health():
+    return database.read_router.snapshot()
+
+
+@app.get("/health/admission")
+def admission_health():
+    return admission.controller.snapshot()
+
+
+@app.get("/health/write-behind")
+def write_behind_health():
+    return write_behind.writer.snapshot()
+
+
+def _pool_metrics():
+    families = {
+        "checked_out": metrics.family(
+            "db_pool_connections_checked_out", "gauge", "Connections currently checked out of the pool."),
+        "size": metrics.family("db_pool_size", "gauge", "Configured pool size (QueuePool only)."),
+        "overflow": metrics.family("db_pool_overflow", "gauge", "Connections open beyond the pool size."),
+        "checkouts": metrics.family("db_pool_checkouts_total", "counter", "Connection checkouts."),
+        "connects": metrics.family("db_pool_connects_total", "counter", "New database connections opened."),
+        "invalidations": metrics.family("db_pool_invalidations_total", "counter", "Connections invalidated."),
+        "latency": metrics.family(
+            "db_pool_checkout_seconds", "histogram", "Time spent waiting for a pooled connection."),
+    }
+    for name, pool in pool_stats.items():
+        if pool.engine is None:
+            continue
+        labels = {"engine": name}
+        snapshot = pool.snapshot()
+        families["checked_out"]["samples"].append(
+            ["db_pool_connections_checked_out", labels, pool.checkouts - pool.checkins])
+        if "size" in snapshot:
+            families["size"]["samples"].append(["db_pool_size", labels, snapshot["size"]])
+            families["overflow"]["samples"].append(["db_pool_overflow", labels, max(snapshot["overflow"], 0)])
+        families["checkouts"]["samples"].append(["db_pool_checkouts_total", labels, pool.checkouts])
+        families["connects"]["samples"].append(["db_pool_connects_total", labels, pool.connects])
+        families["invalidations"]["samples"].append(["db_pool_invalidations_total", labels, pool.invalidations])
+        families["latency"]["samples"].extend(
+            metrics.histogram_samples("db_pool_checkout_seconds", labels, snapshot["checkout_latency_seconds"]))
+    return list(families.values())
+
+
+def _hashing_metrics():
+    executor = auth.hash_executor
+    return [
+        metrics.family("password_hash_seconds", "histogram", "Time spent computing bcrypt hashes and checks.",
+                       metrics.histogram_samples("password_hash_seconds", {}, executor.hash_latency.snapshot())),
+        metrics.family("password_hash_wait_seconds", "histogram", "Time hashing jobs waited for a worker.",
+                       metrics.histogram_samples("password_hash_wait_seconds", {}, executor.wait_latency.snapshot())),
+        metrics.family("password_hash_queue_depth", "gauge", "Hashing jobs running or waiting.",
+                       [["password_hash_queue_depth", {}, executor.pending]]),
+        metrics.family("password_hash_rejected_total", "counter", "Hashing jobs rejected because the queue was full.",
+                       [["password_hash_rejected_total", {}, executor.rejected]]),
+    ]
+
+
+metrics.registry.register_collector(_pool_metrics)
+metrics.registry.register_collector(_hashing_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _violated_constraint(error: IntegrityError) -> str:
+    """Name of the constraint behind an IntegrityError, without the offending values.
+
+    psycopg2 and asyncpg report the constraint name itself; SQLite only names
+    the columns ("UNIQUE constraint failed: users.email"). The message text
+    is cut before PostgreSQL's DETAIL line, which quotes the values.
+    """
+    orig = error.orig
+    for candidate in (orig, getattr(orig, "__cause__", None)):
+        name = getattr(candidate, "constraint_name", None) or getattr(
+            getattr(candidate, "diag", None), "constraint_name", None)
+        if name:
+            return name
+    return str(orig).split("DETAIL")[0].strip().rstrip('"').rsplit('"', 1)[-1]
+
+
+@app.post("/users/register", response_model=schemas.UserRead, status_code=201)
+async def register_user(user_in: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    hashed_password = await auth.get_password_hash_async(user_in.password)
+
+    # The unique indexes on email and username do the duplicate checks, which
+    # keeps this to one statement and closes the race between check and insert.
+    stmt = (
+        insert(models.User)
+        .values(email=user_in.email, username=user_in.username, hashed_password=hashed_password)
+        .returning(models.User)
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    try:
+        user = await db.scalar(stmt)
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if _violated_constraint(e).endswith("email"):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        raise HTTPException(status_code=400, detail="Username already taken")
     return user
 
 
-@app.post("/users/login", response_model=schemas.UserRead)
-def login_user(credentials: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == credentials.email).first()
+@app.post("/users/login", response_model=schemas.LoginResponse)
+async def login_user(credentials: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.email == credentials.email))
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    if not auth.verify_password(credentials.password, user.hashed_password):
+    if not await auth.verify_password_async(credentials.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    return user
+    return schemas.LoginResponse(
+        id=user.id,
+        email=user.email,
+        username=user.username,
+        created_at=user.created_at,
+        access_token=auth.create_access_token(user.id),
+    )
+
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+async def get_current_user_id(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> Optional[int]:
+    """Resolve the bearer token to a user id without touching the database.
+
+    Requests without a token are refused, unless ``ANONYMOUS_CALCULATIONS``
+    lets them through as anonymous (None).
+    """
+    if credentials is None:
+        if auth.ANONYMOUS_CALCULATIONS:
+            return None
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return auth.decode_access_token(credentials.credentials)
+    except auth.InvalidToken:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def _owner_id(user_id: Optional[int], current_user_id: Optional[int]) -> int:
+    if current_user_id is None:
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        return user_id
+    if user_id is not None and user_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Cannot act on behalf of another user")
+    return current_user_id
+
+
+def _client_key(request: Request, current_user_id: Optional[int]):
+    if current_user_id is not None:
+        return ("user", current_user_id)
+    return ("client", request.client.host if request.client else None)
+
+
+async def get_read_db(request: Request, current_user_id: Optional[int] = Depends(get_current_user_id)):
+    """Session for read-only routes: a replica when one is configured and usable."""
+    db = await database.read_router.session(_client_key(request, current_user_id))
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def read_your_writes(request: Request, current_user_id: Optional[int] = Depends(get_current_user_id)):
+    """Keep this client's reads on the primary for a while after a write."""
+    key = _client_key(request, current_user_id)
+    database.read_router.note_write(key)
+    yield
+    # Again once the write is done, so the window starts after the commit.
+    database.read_router.note_write(key)
+
+
+def _user_stats_query(user_id: int):
+    return select(models.UserCalculationStats).where(models.UserCalculationStats.user_id == user_id)
+
+
+@app.get("/users/{user_id}/stats", response_model=schemas.UserStats)
+async def read_user_stats(
+    user_id: int,
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if current_user_id is not None:
+        _owner_id(user_id, current_user_id)
+
+    rows = list(await db.scalars(_user_stats_query(user_id)))
+    if not rows and not await db.get(models.User, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    operations = {
+        row.operation: schemas.OperationStats(count=row.count, result_sum=row.result_sum)
+        for row in rows
+        if row.count
+    }
+    return schemas.UserStats(
+        user_id=user_id,
+        total_count=sum(item.count for item in operations.values()),
+        operations=operations,
+    )
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _encode_cursor(created_at: datetime, calculation_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{calculation_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, calculation_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(calculation_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Read endpoints select these columns directly instead of building ORM
+# objects; the rows expose the same attributes as models.Calculation.
+CALCULATION_COLUMNS = (
+    models.Calculation.id,
+    models.Calculation.operation,
+    models.Calculation.operand_a,
+    models.Calculation.operand_b,
+    models.Calculation.result,
+    models.Calculation.user_id,
+    models.Calculation.created_at,
+)
+
+# Opt-in: serialize read endpoints with orjson straight from the selected
+# rows, skipping response-model validation of data that came from our own
+# database.
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """created_at holds naive UTC times, and asyncpg refuses aware datetimes for it."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _browse_query(
+    limit: Optional[int],
+    after: Optional[Tuple[datetime, int]] = None,
+    user_id: Optional[int] = None,
+    operation: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+):
+    query = select(*CALCULATION_COLUMNS)
+    if user_id is not None:
+        query = query.where(models.Calculation.user_id == user_id)
+    if operation is not None:
+        query = query.where(models.Calculation.operation == operation)
+    if created_after is not None:
+        query = query.where(models.Calculation.created_at >= _naive_utc(created_after))
+    if created_before is not None:
+        query = query.where(models.Calculation.created_at < _naive_utc(created_before))
+    if after is not None:
+        after_created_at, after_id = after
+        query = query.where(
+            tuple_(models.Calculation.created_at, models.Calculation.id) > tuple_(_naive_utc(after_created_at), after_id)
+        )
+    return query.order_by(models.Calculation.created_at, models.Calculation.id).limit(limit)
 
 
 @app.get("/calculations", response_model=List[schemas.CalculationRead])
-def browse_calculations(db: Session = Depends(get_db)):
-    calculations = db.query(models.Calculation).all()
+async def browse_calculations(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    user_id: Optional[int] = None,
+    operation: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Page through calculations ordered by (created_at, id).
+
+    Pages are keyset-based: pass the ``X-Next-Cursor`` header of one page as
+    ``after`` to fetch the next one, so every page costs the same regardless
+    of how deep into the table it is. Authenticated callers only see their
+    own calculations.
+    """
+    if current_user_id is not None:
+        user_id = _owner_id(user_id, current_user_id)
+
+    # Fetch one extra row to learn whether another page exists.
+    calculations = (await db.execute(_browse_query(
+        limit + 1,
+        after=_decode_cursor(after) if after is not None else None,
+        user_id=user_id,
+        operation=operation,
+        created_after=created_after,
+        created_before=created_before,
+    ))).all()
+    headers = {}
+    if len(calculations) > limit:
+        calculations = calculations[:limit]
+        last = calculations[-1]
+        headers["X-Next-Cursor"] = _encode_cursor(last.created_at, last.id)
+
+    if FAST_JSON_RESPONSES:
+        return ORJSONResponse([row._asdict() for row in calculations], headers=headers)
+    response.headers.update(headers)
     return calculations
 
 
+@app.get("/calculations/export")
+async def export_calculations(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv|arrow)$"),
+    user_id: Optional[int] = None,
+    operation: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+):
+    """Stream every matching calculation, ordered by (created_at, id).
+
+    Rows are read through a server-side cursor and encoded a chunk at a
+    time, so memory use does not grow with the size of the export. Send
+    ``Accept-Encoding: gzip`` to get a gzipped body.
+    """
+    if current_user_id is not None:
+        user_id = _owner_id(user_id, current_user_id)
+    try:
+        encoder = exporter.encoder_for(format)
+    except ImportError:
+        raise HTTPException(status_code=400, detail="Arrow export needs pyarrow installed")
+
+    query = _browse_query(
+        None,
+        user_id=user_id,
+        operation=operation,
+        created_after=created_after,
+        created_before=created_before,
+    ).execution_options(yield_per=exporter.DEFAULT_CHUNK_SIZE)
+    key = _client_key(request, current_user_id)
+
+    async def partitions():
+        # The session belongs to the stream, which outlives this function.
+        db = await database.read_router.session(key)
+        try:
+            result = await db.stream(query)
+            async for rows in result.partitions():
+                yield rows
+        finally:
+            await db.close()
+
+    gzip = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "Content-Disposition": f'attachment; filename="calculations.{encoder.extension}"',
+        "Vary": "Accept-Encoding",
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        exporter.encode_stream(partitions(), encoder, gzip=gzip),
+        media_type=encoder.media_type,
+        headers=headers,
+    )
+
+
 @app.get("/calculations/{calculation_id}", response_model=schemas.CalculationRead)
-def read_calculation(calculation_id: int, db: Session = Depends(get_db)):
-    calculation = db.query(models.Calculation).filter(models.Calculation.id == calculation_id).first()
-    if not calculation:
+async def read_calculation(
+    calculation_id: int,
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db),
+):
+    calculation_cache = cache.calculation_cache
+    if calculation_cache.enabled:
+        body = await calculation_cache.get(calculation_id)
+        if body is not None:
+            if current_user_id is not None and orjson.loads(body)["user_id"] != current_user_id:
+                raise HTTPException(status_code=404, detail="Calculation not found")
+            return Response(body, media_type="application/json")
+        version = await calculation_cache.version(calculation_id)
+
+    calculation = (await db.execute(
+        select(*CALCULATION_COLUMNS).where(models.Calculation.id == calculation_id)
+    )).first()
+    if calculation and calculation_cache.enabled:
+        body = schemas.CalculationRead.model_validate(calculation).model_dump_json().encode()
+        await calculation_cache.fill(calculation_id, body, version)
+    if not calculation or current_user_id not in (None, calculation.user_id):
         raise HTTPException(status_code=404, detail="Calculation not found")
+
+    if calculation_cache.enabled:
+        return Response(body, media_type="application/json")
+    if FAST_JSON_RESPONSES:
+        return ORJSONResponse(calculation._asdict())
     return calculation
 
 
-@app.post("/calculations", response_model=schemas.CalculationRead, status_code=201)
-def add_calculation(calc_in: schemas.CalculationCreate, db: Session = Depends(get_db)):
-    if calc_in.operation not in {"add", "subtract", "multiply", "divide"}:
+cache_logger = logging.getLogger("app.cache")
+
+# Delayed invalidations still pending. The event loop only keeps weak
+# references to tasks, so without this one could be collected before it runs.
+_delayed_invalidations = set()
+
+
+async def _invalidate_later(calculation_cache: cache.CalculationCache, calculation_id: int) -> None:
+    await asyncio.sleep(database.READ_YOUR_WRITES_SECONDS)
+    try:
+        await calculation_cache.invalidate(calculation_id)
+    except Exception:
+        cache_logger.exception("Delayed cache invalidation of calculation %s failed", calculation_id)
+
+
+async def _invalidate_cached(calculation_id: int) -> None:
+    calculation_cache = cache.calculation_cache
+    await calculation_cache.invalidate(calculation_id)
+    if database.read_router.replicas:
+        # A replica that has not caught up yet could refill the entry with
+        # the old row, so clear it again once the lag window has passed.
+        task = asyncio.create_task(_invalidate_later(calculation_cache, calculation_id))
+        _delayed_invalidations.add(task)
+        task.add_done_callback(_delayed_invalidations.discard)
+
+
+@app.post(
+    "/calculations", response_model=schemas.CalculationRead, status_code=201,
+    dependencies=[Depends(read_your_writes)],
+)
+async def add_calculation(
+    calc_in: schemas.CalculationCreate,
+    response: Response,
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if calc_in.operation not in op.OPERATIONS:
         raise HTTPException(status_code=400, detail="Invalid operation")
 
-    user = db.query(models.User).filter(models.User.id == calc_in.user_id).first()
-    if not user:
-        raise HTTPException(status_code=400, detail="User not found")
+    user_id = _owner_id(calc_in.user_id, current_user_id)
+    # A valid token already proves the user exists.
+    if current_user_id is None:
+        user = await db.get(models.User, user_id)
+        if not user:
+            raise HTTPException(status_code=400, detail="User not found")
 
     try:
-        if calc_in.operation == "add":
-            result = op.add(calc_in.operand_a, calc_in.operand_b)
-        elif calc_in.operation == "subtract":
-            result = op.subtract(calc_in.operand_a, calc_in.operand_b)
-        elif calc_in.operation == "multiply":
-            result = op.multiply(calc_in.operand_a, calc_in.operand_b)
-        else:
-            result = op.divide(calc_in.operand_a, calc_in.operand_b)
+        result = op.calculate(calc_in.operation, calc_in.operand_a, calc_in.operand_b)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    if write_behind.writer.running:
+        # Accepted, not yet committed: the row is written with the next batch.
+        row = {
+            "id": await write_behind.writer.allocate_id(),
+            "operation": calc_in.operation,
+            "operand_a": calc_in.operand_a,
+            "operand_b": calc_in.operand_b,
+            "result": result,
+            "user_id": user_id,
+            "created_at": datetime.utcnow(),
+        }
+        write_behind.writer.enqueue(row)
+        response.status_code = 202
+        return row
+
     calculation = models.Calculation(
         operation=calc_in.operation,
         operand_a=calc_in.operand_a,
         operand_b=calc_in.operand_b,
         result=result,
-        user_id=calc_in.user_id,
+        user_id=user_id,
     )
     db.add(calculation)
-    db.commit()
-    db.refresh(calculation)
+    delta = stats.StatsDelta()
+    delta.add(user_id, calc_in.operation, result)
+    await db.execute(delta.statement(db.get_bind().dialect.name))
+    await db.commit()
+    await db.refresh(calculation)
+    metrics.calculations_created.inc(calculation.operation)
     return calculation
 
 
-@app.put("/calculations/{calculation_id}", response_model=schemas.CalculationRead)
-def edit_calculation(
-    calculation_id: int,
-    calc_update: schemas.CalculationUpdate,
+MAX_BATCH_SIZE = 10000
+
+
+@app.post(
+    "/calculations/batch", response_model=schemas.CalculationBatchResult, status_code=201,
+    dependencies=[Depends(read_your_writes)],
+)
+async def add_calculations_batch(
+    calcs_in: List[schemas.CalculationCreate],
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if len(calcs_in) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch size exceeds {MAX_BATCH_SIZE}")
+
+    if current_user_id is not None:
+        known_users = {current_user_id}
+    else:
+        user_ids = {calc_in.user_id for calc_in in calcs_in if calc_in.user_id is not None}
+        known_users = set()
+        if user_ids:
+            known_users = set(await db.scalars(select(models.User.id).where(models.User.id.in_(user_ids))))
+
+    rows = []
+    errors = []
+    for index, calc_in in enumerate(calcs_in):
+        try:
+            user_id = _owner_id(calc_in.user_id, current_user_id)
+        except HTTPException as e:
+            errors.append(schemas.BatchItemError(index=index, detail=e.detail))
+            continue
+        if user_id not in known_users:
+            errors.append(schemas.BatchItemError(index=index, detail="User not found"))
+            continue
+        try:
+            result = op.calculate(calc_in.operation, calc_in.operand_a, calc_in.operand_b)
+        except ValueError as e:
+            errors.append(schemas.BatchItemError(index=index, detail=str(e)))
+            continue
+        rows.append({
+            "operation": calc_in.operation,
+            "operand_a": calc_in.operand_a,
+            "operand_b": calc_in.operand_b,
+            "result": result,
+            "user_id": user_id,
+        })
+
+    created_ids = []
+    if rows:
+        stmt = insert(models.Calculation).returning(models.Calculation.id, sort_by_parameter_order=True)
+        created_ids = list(await db.scalars(stmt, rows))
+        delta = stats.StatsDelta()
+        for row in rows:
+            delta.add(row["user_id"], row["operation"], row["result"])
+        await db.execute(delta.statement(db.get_bind().dialect.name))
+        await db.commit()
+        for row in rows:
+            metrics.calculations_created.inc(row["operation"])
+
+    return schemas.CalculationBatchResult(created_ids=created_ids, errors=errors)
+
+
+@app.post(
+    "/calculations/import", response_model=schemas.ImportReport,
+    dependencies=[Depends(read_your_writes)],
+)
+async def import_calculations(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    chunk_size: int = Query(importer.DEFAULT_CHUNK_SIZE, ge=1, le=100000),
+    current_user_id: Optional[int] = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    calculation = db.query(models.Calculation).filter(models.Calculation.id == calculation_id).first()
-    if not calculation:
-        raise HTTPException(status_code=404, detail="Calculation not found")
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "csv" if content_type.startswith("text/csv") else "ndjson"
 
-    if calc_update.operation is not None:
-        if calc_update.operation not in {"add", "subtract", "multiply", "divide"}:
-            raise HTTPException(status_code=400, detail="Invalid operation")
-        calculation.operation = calc_update.operation
+    calculation_importer = importer.CalculationImporter(
+        db, fmt=format, chunk_size=chunk_size, owner_id=current_user_id,
+    )
+    async for data in request.stream():
+        if data:
+            await run_in_threadpool(calculation_importer.feed, data)
+    report = await run_in_threadpool(calculation_importer.finish)
+    for operation, count in calculation_importer.operation_counts.items():
+        metrics.calculations_created.inc(operation, amount=count)
+    return report
+
+
+def _owned_calculation(calculation_id: int, current_user_id: Optional[int]):
+    """WHERE criteria for a calculation the caller may change; other users' rows look missing."""
+    criteria = [models.Calculation.id == calculation_id]
+    if current_user_id is not None:
+        criteria.append(models.Calculation.user_id == current_user_id)
+    return criteria
+
+
+def _sql_result(operation, a, b):
+    """The result computed in SQL, mirroring ``app.operations.OPERATIONS``."""
+    return case(
+        {"add": a + b, "subtract": a - b, "multiply": a * b, "divide": a / b},
+        value=operation,
+    )
 
+
+def _edit_statement(calc_update: schemas.CalculationUpdate):
+    """UPDATE applying the given fields (others keep their stored values) and
+    recomputing the result in the same statement.
+
+    Division by zero matches no row; the caller tells that apart from a
+    missing row.
+    """
+    table = models.Calculation
+    values = {}
+    operation, operand_a, operand_b = table.operation, table.operand_a, table.operand_b
+    if calc_update.operation is not None:
+        operation = values["operation"] = literal(calc_update.operation)
     if calc_update.operand_a is not None:
-        calculation.operand_a = calc_update.operand_a
+        operand_a = values["operand_a"] = literal(calc_update.operand_a, Float)
     if calc_update.operand_b is not None:
-        calculation.operand_b = calc_update.operand_b
+        operand_b = values["operand_b"] = literal(calc_update.operand_b, Float)
+    values["result"] = _sql_result(operation, operand_a, operand_b)
+    return (
+        update(table)
+        .where(~and_(operation == "divide", operand_b == 0))
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+@app.put(
+    "/calculations/{calculation_id}", response_model=schemas.CalculationRead,
+    dependencies=[Depends(read_your_writes)],
+)
+async def edit_calculation(
+    calculation_id: int,
+    calc_update: schemas.CalculationUpdate,
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if calc_update.operation is not None and calc_update.operation not in op.OPERATIONS:
+        raise HTTPException(status_code=400, detail="Invalid operation")
+
+    dialect_name = db.get_bind().dialect.name
+    criteria = _owned_calculation(calculation_id, current_user_id)
+    stmt = _edit_statement(calc_update)
+    if dialect_name == "postgresql":
+        # Lock and read the old row in the same statement so the stats delta
+        # matches exactly the version this update replaced.
+        old = select(
+            models.Calculation.id, models.Calculation.operation, models.Calculation.result
+        ).where(*criteria).with_for_update().subquery("old")
+        stmt = stmt.where(models.Calculation.id == old.c.id).returning(
+            *CALCULATION_COLUMNS, old.c.operation.label("old_operation"), old.c.result.label("old_result")
+        )
+    else:
+        # SQLite's RETURNING cannot see the old row. Take it out of the stats
+        # first instead: that statement also takes the database's write lock,
+        # so the row cannot change before the update below.
+        await db.execute(stats.removal_statement(dialect_name, *criteria))
+        stmt = stmt.where(*criteria).returning(*CALCULATION_COLUMNS)
 
     try:
-        if calculation.operation == "add":
-            calculation.result = op.add(calculation.operand_a, calculation.operand_b)
-        elif calculation.operation == "subtract":
-            calculation.result = op.subtract(calculation.operand_a, calculation.operand_b)
-        elif calculation.operation == "multiply":
-            calculation.result = op.multiply(calculation.operand_a, calculation.operand_b)
-        else:
-            calculation.result = op.divide(calculation.operand_a, calculation.operand_b)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        calculation = (await db.execute(stmt)).one_or_none()
+    except DataError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Result is not a finite number")
+    if calculation is None:
+        await db.rollback()
+        exists = await db.scalar(select(models.Calculation.id).where(*criteria))
+        if exists is None:
+            raise HTTPException(status_code=404, detail="Calculation not found")
+        raise HTTPException(status_code=400, detail="Division by zero is not allowed")
+    if not math.isfinite(calculation.result):
+        # PostgreSQL raises on the overflow above; SQLite stores infinity.
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Result is not a finite number")
 
-    db.commit()
-    db.refresh(calculation)
+    delta = stats.StatsDelta()
+    if dialect_name == "postgresql":
+        delta.remove(calculation.user_id, calculation.old_operation, calculation.old_result)
+    delta.add(calculation.user_id, calculation.operation, calculation.result)
+    stats_stmt = delta.statement(dialect_name)
+    if stats_stmt is not None:
+        await db.execute(stats_stmt)
+    await db.commit()
+    await _invalidate_cached(calculation_id)
     return calculation
 
 
-@app.delete("/calculations/{calculation_id}", status_code=204)
-def delete_calculation(calculation_id: int, db: Session = Depends(get_db)):
-    calculation = db.query(models.Calculation).filter(models.Calculation.id == calculation_id).first()
-    if not calculation:
+@app.delete(
+    "/calculations/{calculation_id}", status_code=204,
+    dependencies=[Depends(read_your_writes)],
+)
+async def delete_calculation(
+    calculation_id: int,
+    current_user_id: Optional[int] = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = (
+        delete(models.Calculation)
+        .where(*_owned_calculation(calculation_id, current_user_id))
+        .returning(models.Calculation.user_id, models.Calculation.operation, models.Calculation.result)
+    )
+    calculation = (await db.execute(stmt)).one_or_none()
+    if calculation is None:
         raise HTTPException(status_code=404, detail="Calculation not found")
 
-    db.delete(calculation)
-    db.commit()
+    delta = stats.StatsDelta()
+    delta.remove(calculation.user_id, calculation.operation, calculation.result)
+    await db.execute(delta.statement(db.get_bind().dialect.name))
+    await db.commit()
+    await _invalidate_cached(calculation_id)
     return None
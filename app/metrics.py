@@ -0,0 +1,395 @@
+"""In-process metric primitives and a Prometheus text exposition.
+
+Metric families live in ``registry`` and are updated in place: request
+metrics only ever change on the event loop thread, so they need no locks.
+With several worker processes, set ``METRICS_MULTIPROC_DIR`` to a directory
+shared by the workers (and emptied when the server starts). Each worker then
+writes its own snapshot there at most every ``METRICS_FLUSH_INTERVAL``
+seconds, and a scrape of any worker merges all of them. The counters and
+histograms of workers that have exited are folded into one aggregate file,
+so the directory stays as small as the set of live workers.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; tuned for latencies between sub-millisecond and a few seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# In the multi-process directory: the totals of exited workers, and the lock
+# taken while snapshots are read or folded into them.
+EXITED_SNAPSHOT = "metrics-exited.json"
+LOCK_FILE = "metrics.lock"
+
+
+class _NoLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Histogram:
+    """Fixed-bucket histogram that is safe to observe from several threads.
+
+    Pass ``thread_safe=False`` for histograms only ever observed from one
+    thread, such as the event loop, to skip the lock.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, thread_safe: bool = True):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock() if thread_safe else _NoLock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+
+        cumulative = 0
+        buckets = {}
+        for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            buckets["+Inf" if upper_bound == float("inf") else str(upper_bound)] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+
+def family(name: str, kind: str, documentation: str, samples=None) -> dict:
+    """A metric family in the form collectors return and snapshots store.
+
+    ``samples`` is a list of ``[sample_name, labels, value]``.
+    """
+    return {"name": name, "type": kind, "help": documentation, "samples": samples if samples is not None else []}
+
+
+def histogram_samples(name: str, labels: dict, snapshot: dict) -> list:
+    """Expand a ``Histogram.snapshot()`` into exposition samples."""
+    samples = [[f"{name}_bucket", {**labels, "le": le}, count] for le, count in snapshot["buckets"].items()]
+    samples.append([f"{name}_sum", labels, snapshot["sum"]])
+    samples.append([f"{name}_count", labels, snapshot["count"]])
+    return samples
+
+
+class _Family:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, labelvalues) -> dict:
+        return dict(zip(self.labelnames, labelvalues))
+
+    def collect(self) -> dict:
+        return family(self.name, self.kind, self.documentation, self._samples())
+
+
+class Counter(_Family):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def _samples(self):
+        return [[self.name, self._labels(key), value] for key, value in list(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value: float) -> None:
+        self._values[labelvalues] = value
+
+
+class HistogramFamily(_Family):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self._children = {}
+
+    def labels(self, *labelvalues) -> Histogram:
+        child = self._children.get(labelvalues)
+        if child is None:
+            child = self._children[labelvalues] = Histogram(self.buckets, thread_safe=False)
+        return child
+
+    def _samples(self):
+        samples = []
+        for key, child in list(self._children.items()):
+            samples.extend(histogram_samples(self.name, self._labels(key), child.snapshot()))
+        return samples
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(families: list, merged: dict, include_gauges: bool = True) -> None:
+    """Add ``families`` into ``merged`` (name -> (family, {sample key: value}))."""
+    for item in families:
+        if item["type"] == "gauge" and not include_gauges:
+            continue
+        entry = merged.setdefault(item["name"], (item, {}))
+        values = entry[1]
+        for sample_name, labels, value in item["samples"]:
+            key = (sample_name, tuple(labels.items()))
+            values[key] = values.get(key, 0) + value
+
+
+def _unmerge(merged: dict) -> list:
+    """Turn a ``_merge`` result back into a list of families."""
+    return [
+        family(name, item["type"], item["help"],
+               [[sample_name, dict(labels), value] for (sample_name, labels), value in values.items()])
+        for name, (item, values) in merged.items()
+    ]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value))
+
+
+class Registry:
+    """A set of metric families plus collectors that are read at scrape time."""
+
+    def __init__(self, multiproc_dir=METRICS_MULTIPROC_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self._families = []
+        self._collectors = []
+        self._last_flush = 0.0
+        self._flush_scheduled = False
+        self._snapshot_pid = None
+
+    def _add(self, metric):
+        self._families.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> HistogramFamily:
+        return self._add(HistogramFamily(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector) -> None:
+        """``collector()`` returns a list of ``family(...)`` dicts when scraped."""
+        self._collectors.append(collector)
+
+    def collect(self) -> list:
+        families = [metric.collect() for metric in self._families]
+        for collector in self._collectors:
+            families.extend(collector())
+        return families
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiproc_dir, f"metrics-{pid}.json")
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.multiproc_dir, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write_json(self, path: str, families: list) -> None:
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as output:
+            json.dump(families, output)
+        os.replace(temporary, path)
+
+    def _read_json(self, path: str) -> list:
+        try:
+            with open(path) as snapshot:
+                return json.load(snapshot)
+        except (OSError, ValueError):
+            return []
+
+    def _fold_exited(self, pid: int) -> None:
+        """Add the counters and histograms of exited process ``pid`` to the
+        aggregate snapshot and remove its own. Call with the lock held."""
+        path = self._snapshot_path(pid)
+        aggregate = os.path.join(self.multiproc_dir, EXITED_SNAPSHOT)
+        merged = {}
+        _merge(self._read_json(aggregate), merged)
+        _merge(self._read_json(path), merged, include_gauges=False)
+        self._write_json(aggregate, _unmerge(merged))
+        os.remove(path)
+
+    def write_snapshot(self) -> None:
+        """Write this process's metrics to the multi-process directory."""
+        self._last_flush = time.monotonic()
+        self._flush_scheduled = False
+        pid = os.getpid()
+        path = self._snapshot_path(pid)
+        if self._snapshot_pid != pid:
+            # A file under this pid was left by an exited process that had
+            # the same pid; keep its totals instead of overwriting them.
+            with self._locked():
+                if os.path.exists(path):
+                    self._fold_exited(pid)
+            self._snapshot_pid = pid
+        self._write_json(path, self.collect())
+
+    def maybe_flush(self) -> None:
+        """Make sure the snapshot on disk is at most ``flush_interval`` old.
+
+        Called from the event loop after each request; writes right away when
+        the interval has passed, otherwise schedules one trailing write.
+        """
+        if self.multiproc_dir is None or self._flush_scheduled:
+            return
+        remaining = self._last_flush + self.flush_interval - time.monotonic()
+        if remaining <= 0:
+            self.write_snapshot()
+        else:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_later(remaining, self.write_snapshot)
+
+    def render(self) -> str:
+        """Text exposition of this process, merged with every other worker's snapshot.
+
+        Counters and histograms of workers that have exited are kept so the
+        totals never go backwards; their gauges are dropped. Their snapshots
+        are folded into the aggregate on the way.
+        """
+        merged = {}
+        _merge(self.collect(), merged)
+        if self.multiproc_dir is not None:
+            own = os.getpid()
+            # Held throughout, so a snapshot being folded by another worker's
+            # scrape is never counted twice, or missed.
+            with self._locked():
+                live = []
+                for filename in os.listdir(self.multiproc_dir):
+                    if not (filename.startswith("metrics-") and filename.endswith(".json")):
+                        continue
+                    if filename == EXITED_SNAPSHOT:
+                        continue
+                    pid = int(filename[len("metrics-"):-len(".json")])
+                    if pid == own:
+                        # Left by an exited process with our pid if we have
+                        # not written a snapshot yet.
+                        if self._snapshot_pid != own:
+                            self._fold_exited(pid)
+                    elif _pid_alive(pid):
+                        live.append(filename)
+                    else:
+                        self._fold_exited(pid)
+                for filename in sorted(live) + [EXITED_SNAPSHOT]:
+                    _merge(self._read_json(os.path.join(self.multiproc_dir, filename)), merged)
+
+        lines = []
+        for name, (item, values) in merged.items():
+            lines.append(f"# HELP {name} {item['help']}")
+            lines.append(f"# TYPE {name} {item['type']}")
+            for (sample_name, labels), value in values.items():
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+                    lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{sample_name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by method, route template and status.", ("method", "route", "status"))
+http_errors = registry.counter(
+    "http_request_errors_total", "HTTP requests that ended in a 5xx response.", ("method", "route"))
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Time from request start to the end of the response body.", ("method", "route"))
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being served.", ("method",))
+calculations_created = registry.counter(
+    "calculations_created_total", "Calculations created, by operation.", ("operation",))
+
+# Used for requests that matched no route, so that unknown paths cannot
+# create an unbounded number of label values.
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware that records request metrics by route template.
+
+    The template is read from ``scope["route"]``, which the router fills in
+    while matching (see ``profiling.ProfiledRoute``).
+    """
+
+    def __init__(self, app, registry: Registry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        start = time.perf_counter()
+        http_in_flight.inc(method)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec(method)
+            route = scope.get("route")
+            template = getattr(route, "path", UNMATCHED_ROUTE)
+            http_requests.inc(method, template, str(status))
+            if status >= 500:
+                http_errors.inc(method, template)
+            http_latency.labels(method, template).observe(time.perf_counter() - start)
+            self.registry.maybe_flush()
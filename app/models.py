@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -33,3 +33,28 @@ class Calculation(Base):
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", back_populates="calculations")
+
+    # Every listing is ordered by (created_at, id), so each index ends in
+    # (created_at, id) to serve the filter and the keyset order together
+    # without a sort. The id has to be spelled out: SQLite appends the rowid
+    # to every index, but PostgreSQL does not.
+    __table_args__ = (
+        Index("ix_calculations_created_at_id", "created_at", "id"),
+        Index("ix_calculations_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_calculations_operation_created_at_id", "operation", "created_at", "id"),
+    )
+
+
+class UserCalculationStats(Base):
+    """Per-user, per-operation running totals of the calculations table.
+
+    Kept up to date in the same transaction as every calculation write so
+    that reading a user's stats never has to scan ``calculations``.
+    """
+
+    __tablename__ = "user_calculation_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    operation = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    result_sum = Column(Float, nullable=False, default=0.0)
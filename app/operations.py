@@ -1,5 +1,7 @@
 """Mathematical operations for calculator."""
 
+import numpy as np
+
 
 def add(a: float, b: float) -> float:
     """Add two numbers."""
@@ -21,3 +23,78 @@ def divide(a: float, b: float) -> float:
     if b == 0:
         raise ValueError("Division by zero is not allowed")
     return a / b
+
+
+OPERATIONS = {
+    "add": add,
+    "subtract": subtract,
+    "multiply": multiply,
+    "divide": divide,
+}
+
+
+def calculate(operation: str, a: float, b: float) -> float:
+    """Apply the named operation to a and b."""
+    try:
+        func = OPERATIONS[operation]
+    except KeyError:
+        raise ValueError("Invalid operation")
+    return func(a, b)
+
+
+VECTOR_OK = 0
+VECTOR_INVALID_OPERATION = 1
+VECTOR_DIVISION_BY_ZERO = 2
+VECTOR_NOT_FINITE = 3
+
+VECTOR_ERROR_MESSAGES = {
+    VECTOR_INVALID_OPERATION: "Invalid operation",
+    VECTOR_DIVISION_BY_ZERO: "Division by zero is not allowed",
+    VECTOR_NOT_FINITE: "Result is not a finite number",
+}
+
+VECTOR_UFUNCS = {
+    "add": np.add,
+    "subtract": np.subtract,
+    "multiply": np.multiply,
+    "divide": np.divide,
+}
+
+
+def vector_calculate(operations, a, b):
+    """Apply operations element-wise to the operand arrays a and b.
+
+    ``operations`` is either one operation name applied to every pair or a
+    sequence of names, one per pair. Returns ``(results, errors)``: a float64
+    array of results and a uint8 array of ``VECTOR_*`` codes. Elements with a
+    non-zero code have a NaN result.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if a.ndim != 1 or a.shape != b.shape:
+        raise ValueError("Operands must be one-dimensional arrays of equal length")
+
+    results = np.full(a.shape, np.nan)
+    errors = np.zeros(a.shape, dtype=np.uint8)
+
+    if isinstance(operations, str):
+        if operations not in VECTOR_UFUNCS:
+            raise ValueError("Invalid operation")
+        masks = {operations: np.ones(a.shape, dtype=bool)}
+    else:
+        ops = np.asarray(operations)
+        if ops.shape != a.shape:
+            raise ValueError("Operations must have the same length as the operands")
+        masks = {name: ops == name for name in VECTOR_UFUNCS}
+        errors[~np.logical_or.reduce(list(masks.values()))] = VECTOR_INVALID_OPERATION
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        for name, mask in masks.items():
+            if name == "divide":
+                zero = mask & (b == 0)
+                errors[zero] = VECTOR_DIVISION_BY_ZERO
+                mask = mask & ~zero
+            VECTOR_UFUNCS[name](a, b, out=results, where=mask)
+
+    errors[(errors == VECTOR_OK) & ~np.isfinite(results)] = VECTOR_NOT_FINITE
+    return results, errors
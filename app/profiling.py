@@ -0,0 +1,217 @@
+"""Per-request profiling: Server-Timing headers, SQL counters and slow-request stacks.
+
+``ProfilingMiddleware`` puts a ``RequestTimings`` in a context variable for
+the duration of each request. SQLAlchemy cursor events, the password hashing
+executor and the route wrapper add to it from wherever they run (event loop,
+threadpool or SQLAlchemy's async greenlets all inherit the context), and the
+middleware reports the totals in a ``Server-Timing`` header and one JSON log
+line per request.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from starlette.routing import Match
+
+logger = logging.getLogger("app.profiling")
+
+# Requests slower than this dump their sampled stacks; 0 disables sampling.
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "profiles")
+
+
+class RequestTimings:
+    __slots__ = ("sql_seconds", "sql_count", "hash_seconds", "endpoint_done")
+
+    def __init__(self):
+        self.sql_seconds = 0.0
+        self.sql_count = 0
+        self.hash_seconds = 0.0
+        self.endpoint_done = None
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def record_hash_time(seconds: float) -> None:
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.hash_seconds += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.sql_seconds += elapsed
+        timings.sql_count += 1
+
+
+def instrument_engine(sync_engine) -> None:
+    """Count statements and SQL time for the current request on ``sync_engine``."""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _mark_endpoint_done() -> None:
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.endpoint_done = time.perf_counter()
+
+
+class ProfiledRoute(APIRoute):
+    """Route that notes when the endpoint function returns.
+
+    Everything between that moment and the response start is response-model
+    validation, encoding and rendering, which is reported as ``serialize``.
+    A matching route also puts itself in ``scope["route"]`` (as newer
+    Starlette releases do) so middleware can label requests by template.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kw):
+                try:
+                    return await endpoint(*args, **kw)
+                finally:
+                    _mark_endpoint_done()
+        else:
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args, **kw):
+                try:
+                    return endpoint(*args, **kw)
+                finally:
+                    _mark_endpoint_done()
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def matches(self, scope):
+        match, child_scope = super().matches(scope)
+        if match != Match.NONE:
+            child_scope["route"] = self
+        return match, child_scope
+
+
+class StackSampler:
+    """Background thread that samples every thread's stack at a fixed interval.
+
+    Samples are kept in a ring buffer so a slow request can pull out the ones
+    taken while it ran and write them in collapsed ("folded") form, ready for
+    flamegraph.pl or speedscope. Concurrent requests share threads, so a dump
+    can include frames from other work that was running at the same time.
+    """
+
+    def __init__(self, interval: float, window: float = 60.0):
+        self.interval = interval
+        self.samples = deque(maxlen=max(1, int(window / interval)))
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.samples.append((now, self._collapse(names.get(ident, str(ident)), frame)))
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        stack.append(thread_name)
+        return ";".join(reversed(stack))
+
+    def dump(self, start: float, end: float, path: str) -> int:
+        """Write the samples taken between start and end to path; returns the count."""
+        counts = Counter(stack for taken, stack in list(self.samples) if start <= taken <= end)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as output:
+            for stack, count in counts.most_common():
+                output.write(f"{stack} {count}\n")
+        return sum(counts.values())
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware that reports where each request spent its time."""
+
+    def __init__(self, app, slow_ms: float = PROFILE_SLOW_MS, sample_interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS,
+                 output_dir: str = PROFILE_OUTPUT_DIR):
+        self.app = app
+        self.slow_seconds = slow_ms / 1000
+        self.output_dir = output_dir
+        self.sampler = StackSampler(sample_interval_ms / 1000) if slow_ms > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+        serialize = 0.0
+
+        async def send_with_timing(message):
+            nonlocal status, serialize
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                if timings.endpoint_done is not None:
+                    serialize = now - timings.endpoint_done
+                MutableHeaders(scope=message).append("Server-Timing", ", ".join([
+                    f"total;dur={_ms(now - start)}",
+                    f'db;dur={_ms(timings.sql_seconds)};desc="{timings.sql_count} queries"',
+                    f"serialize;dur={_ms(serialize)}",
+                    f"hash;dur={_ms(timings.hash_seconds)}",
+                ]))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timings.reset(token)
+            end = time.perf_counter()
+            record = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "total_ms": _ms(end - start),
+                "db_ms": _ms(timings.sql_seconds),
+                "db_queries": timings.sql_count,
+                "serialize_ms": _ms(serialize),
+                "hash_ms": _ms(timings.hash_seconds),
+            }
+            if self.sampler is not None and end - start >= self.slow_seconds:
+                route = scope["path"].strip("/").replace("/", "_") or "root"
+                name = f"{int(time.time() * 1000)}-{scope['method']}-{route}"
+                record["profile"] = os.path.join(self.output_dir, f"{name}.folded")
+                self.sampler.dump(start, end, record["profile"])
+            logger.info(json.dumps(record))
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, model_validator
+from typing import Dict, List, Optional
 from datetime import datetime
 
 
@@ -25,6 +25,11 @@ class UserRead(UserBase):
         from_attributes = True
 
 
+class LoginResponse(UserRead):
+    access_token: str
+    token_type: str = "bearer"
+
+
 class CalculationBase(BaseModel):
     operation: str
     operand_a: float
@@ -33,7 +38,12 @@ class CalculationBase(BaseModel):
 
 
 class CalculationCreate(CalculationBase):
-    pass
+    # Optional when the request carries an access token for the user.
+    user_id: Optional[int] = None
+
+
+class CalculationImportRow(CalculationCreate):
+    created_at: Optional[datetime] = None
 
 
 class CalculationUpdate(BaseModel):
@@ -49,3 +59,73 @@ class CalculationRead(CalculationBase):
 
     class Config:
         from_attributes = True
+
+
+class BatchItemError(BaseModel):
+    index: int
+    detail: str
+
+
+class CalculationBatchResult(BaseModel):
+    created_ids: List[int]
+    errors: List[BatchItemError]
+
+
+MAX_VECTOR_LENGTH = 1_000_000
+
+
+class VectorRequest(BaseModel):
+    operation: Optional[str] = None
+    operations: Optional[List[str]] = Field(default=None, max_length=MAX_VECTOR_LENGTH)
+    a: List[float] = Field(max_length=MAX_VECTOR_LENGTH)
+    b: List[float] = Field(max_length=MAX_VECTOR_LENGTH)
+
+    @model_validator(mode="after")
+    def check_operation(self):
+        if (self.operation is None) == (self.operations is None):
+            raise ValueError("Provide exactly one of operation or operations")
+        return self
+
+
+class VectorResult(BaseModel):
+    results: List[Optional[float]]
+    errors: List[BatchItemError]
+
+
+class ImportRejection(BaseModel):
+    line: int
+    detail: str
+
+
+class ImportReport(BaseModel):
+    imported: int
+    rejected: int
+    rejections: List[ImportRejection]
+    elapsed_seconds: float
+    rows_per_second: float
+
+
+class OperationStats(BaseModel):
+    count: int
+    result_sum: float
+
+
+class UserStats(BaseModel):
+    user_id: int
+    total_count: int
+    operations: Dict[str, OperationStats]
+
+
+MAX_EVALUATE_BINDINGS = 10000
+
+
+class EvaluateRequest(BaseModel):
+    expression: str = Field(min_length=1, max_length=1000)
+    bindings: List[Dict[str, float]] = Field(default_factory=lambda: [{}], min_length=1, max_length=MAX_EVALUATE_BINDINGS)
+
+
+class EvaluateResult(BaseModel):
+    expression: str
+    variables: List[str]
+    results: List[Optional[float]]
+    errors: List[BatchItemError]
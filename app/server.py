@@ -0,0 +1,110 @@
+"""Production launcher: gunicorn supervising uvicorn workers.
+
+The application is imported once in the master (``preload_app``), so workers
+share its memory copy-on-write. The uvicorn worker picks uvloop and httptools
+when they are installed. SIGTERM drains in-flight requests for up to
+``GRACEFUL_TIMEOUT`` seconds, and each worker restarts after roughly
+``MAX_REQUESTS`` requests to keep slow leaks bounded. Every setting comes from
+the environment, so one image fits any machine size.
+
+Usage: python -m app.server
+"""
+
+import math
+import os
+
+from gunicorn.app.base import BaseApplication
+
+WORKER_CLASS = "uvicorn.workers.UvicornWorker"
+
+
+def _env_bool(environ, name: str, default: str) -> bool:
+    return environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on, honouring affinity and a cgroup v2 quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def build_options(environ=os.environ) -> dict:
+    # Each worker runs its own event loop, so one per CPU keeps every core busy.
+    workers = int(environ.get("WEB_CONCURRENCY") or available_cpus())
+    return {
+        "bind": environ.get("BIND", f"{environ.get('HOST', '0.0.0.0')}:{environ.get('PORT', '8000')}"),
+        "workers": workers,
+        "worker_class": WORKER_CLASS,
+        "preload_app": _env_bool(environ, "PRELOAD_APP", "true"),
+        "graceful_timeout": int(environ.get("GRACEFUL_TIMEOUT", "30")),
+        "timeout": int(environ.get("WORKER_TIMEOUT", "60")),
+        "keepalive": int(environ.get("KEEPALIVE", "5")),
+        "max_requests": int(environ.get("MAX_REQUESTS", "10000")),
+        # Spread the restarts so the workers do not all recycle at once.
+        "max_requests_jitter": int(environ.get("MAX_REQUESTS_JITTER", "1000")),
+        "backlog": int(environ.get("BACKLOG", "2048")),
+        "loglevel": environ.get("LOG_LEVEL", "info"),
+        "accesslog": environ.get("ACCESS_LOG") or None,
+        "on_starting": on_starting,
+        "post_fork": post_fork,
+    }
+
+
+def on_starting(server):
+    # Snapshots left by a previous run would be merged into the new totals.
+    from app import metrics
+
+    directory = metrics.METRICS_MULTIPROC_DIR
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        for filename in os.listdir(directory):
+            if filename.startswith("metrics-"):
+                os.remove(os.path.join(directory, filename))
+
+
+def post_fork(server, worker):
+    # A forked worker must never reuse a connection opened in the master;
+    # drop the inherited pools without closing sockets the master still owns.
+    from app.database import async_engine, engine, read_router
+
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    for replica in read_router.replicas:
+        replica.sync_engine.dispose(close=False)
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app
+
+        return app
+
+
+def main():
+    options = build_options()
+    # Read by the application when the master imports it, e.g. to keep the
+    # per-process calculation cache off when there are several workers.
+    os.environ["WEB_CONCURRENCY"] = str(options["workers"])
+    Server(options).run()
+
+
+if __name__ == "__main__":
+    main()
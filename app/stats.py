@@ -0,0 +1,120 @@
+"""Maintenance of the per-user calculation summary table."""
+
+from collections import defaultdict
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import models
+
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+class StatsDelta:
+    """Accumulates count and sum changes per (user_id, operation)."""
+
+    def __init__(self):
+        self.changes = defaultdict(lambda: [0, 0.0])
+
+    def add(self, user_id: int, operation: str, result: float) -> None:
+        change = self.changes[(user_id, operation)]
+        change[0] += 1
+        change[1] += result
+
+    def remove(self, user_id: int, operation: str, result: float) -> None:
+        change = self.changes[(user_id, operation)]
+        change[0] -= 1
+        change[1] -= result
+
+    def statement(self, dialect_name: str):
+        """Build one multi-row upsert applying every change, or None if empty.
+
+        Rows are sorted by key so concurrent upserts lock the stats rows in
+        the same order and cannot deadlock each other.
+        """
+        rows = [
+            {"user_id": user_id, "operation": operation, "count": count, "result_sum": result_sum}
+            for (user_id, operation), (count, result_sum) in sorted(self.changes.items())
+            if count or result_sum
+        ]
+        if not rows:
+            return None
+
+        return _accumulate(UPSERT_INSERTS[dialect_name](models.UserCalculationStats).values(rows))
+
+
+def _accumulate(stmt):
+    table = models.UserCalculationStats
+    return stmt.on_conflict_do_update(
+        index_elements=[table.user_id, table.operation],
+        set_={
+            "count": table.count + stmt.excluded.count,
+            "result_sum": table.result_sum + stmt.excluded.result_sum,
+        },
+    )
+
+
+def removal_statement(dialect_name: str, *criteria):
+    """Upsert that takes one calculation, selected by ``criteria``, out of the totals.
+
+    The row is read by the statement itself, so the caller never has to
+    fetch it first. ``criteria`` must match at most one calculation.
+    """
+    calculation = models.Calculation
+    source = select(
+        calculation.user_id, calculation.operation, literal(-1), -calculation.result
+    ).where(*criteria)
+    stmt = UPSERT_INSERTS[dialect_name](models.UserCalculationStats).from_select(
+        ["user_id", "operation", "count", "result_sum"], source
+    )
+    return _accumulate(stmt)
+
+
+def _aggregate_query():
+    return select(
+        models.Calculation.user_id,
+        models.Calculation.operation,
+        func.count(models.Calculation.id),
+        func.coalesce(func.sum(models.Calculation.result), 0.0),
+    ).group_by(models.Calculation.user_id, models.Calculation.operation)
+
+
+def rebuild_stats(db: Session) -> int:
+    """Recompute the summary table from the calculations table.
+
+    Returns the number of summary rows written.
+    """
+    db.execute(delete(models.UserCalculationStats))
+    result = db.execute(
+        insert(models.UserCalculationStats).from_select(
+            ["user_id", "operation", "count", "result_sum"], _aggregate_query()
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def check_stats(db: Session, tolerance: float = 1e-6):
+    """Compare the summary table against a fresh aggregate.
+
+    Returns a list of ``(user_id, operation, stored, expected)`` tuples for
+    every row that disagrees, where stored/expected are ``(count, sum)``.
+    """
+    expected = {(user_id, operation): (count, total) for user_id, operation, count, total in db.execute(_aggregate_query())}
+    stored = {
+        (row.user_id, row.operation): (row.count, row.result_sum)
+        for row in db.scalars(select(models.UserCalculationStats))
+        if row.count
+    }
+
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        stored_count, stored_sum = stored.get(key, (0, 0.0))
+        expected_count, expected_sum = expected.get(key, (0, 0.0))
+        if stored_count != expected_count or abs(stored_sum - expected_sum) > tolerance * max(1.0, abs(expected_sum)):
+            mismatches.append((key[0], key[1], (stored_count, stored_sum), (expected_count, expected_sum)))
+    return mismatches
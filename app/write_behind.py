@@ -0,0 +1,253 @@
+"""Optional write-behind queue for new calculations.
+
+With ``WRITE_BEHIND`` enabled, ``POST /calculations`` computes the result,
+takes an id from a block reserved ahead of time, queues the row and answers
+``202 Accepted`` without waiting for a commit. A background task writes the
+queue in multi-row inserts (with the matching stats upsert in the same
+transaction) whenever ``WRITE_BEHIND_BATCH_SIZE`` rows are waiting or
+``WRITE_BEHIND_FLUSH_INTERVAL`` seconds have passed, and drains it on
+shutdown. A full queue rejects new rows with ``QueueFull`` instead of
+growing without bound.
+
+Ids come from the ``calculations`` sequence on PostgreSQL, so they never
+collide with rows written by other workers or other routes. SQLite has no
+sequences, and the other routes take ``max(id) + 1`` as they insert, which
+could hand out an id already promised to a queued row. Write-behind
+therefore does not start on SQLite and ``POST /calculations`` keeps writing
+synchronously.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+
+from sqlalchemy import insert, text
+from sqlalchemy.exc import IntegrityError
+
+from app import metrics, models, stats
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger("app.write_behind")
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_ID_BLOCK = int(os.getenv("WRITE_BEHIND_ID_BLOCK", "1000"))
+
+# Attempts to write what is left in the queue at shutdown before giving up.
+DRAIN_ATTEMPTS = 3
+
+# Databases whose sequences can hand out ids that no other insert will take.
+SEQUENCE_DIALECTS = ("postgresql",)
+
+
+class QueueFull(Exception):
+    """Raised when the write-behind queue has no room for another row."""
+
+
+class IdAllocator:
+    """Hands out calculation ids from blocks reserved in one round trip."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, block_size: int = WRITE_BEHIND_ID_BLOCK):
+        self.session_factory = session_factory
+        self.block_size = block_size
+        self._ids = deque()
+        self._lock = asyncio.Lock()
+
+    async def next_id(self) -> int:
+        if not self._ids:
+            async with self._lock:
+                if not self._ids:
+                    self._ids.extend(await self._reserve())
+        return self._ids.popleft()
+
+    async def _reserve(self):
+        async with self.session_factory() as db:
+            sequence = f"{models.Calculation.__tablename__}_id_seq"
+            result = await db.scalars(
+                text(f"SELECT nextval('{sequence}') FROM generate_series(1, :n)"), {"n": self.block_size}
+            )
+            return list(result)
+
+
+class WriteBehindQueue:
+    """Buffers calculation rows and writes them in batches from one task.
+
+    ``enqueue`` and the flush task both run on the event loop, so the
+    buffer and counters need no locks.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL, max_pending: int = WRITE_BEHIND_QUEUE_SIZE,
+                 id_block_size: int = WRITE_BEHIND_ID_BLOCK):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.ids = IdAllocator(session_factory, id_block_size)
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.retries = 0
+        self.last_error = None
+        self.disabled_reason = None
+        self._rows = []
+        self._in_flight = 0
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        # A flusher that died must not leave the endpoint answering 202.
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows) + self._in_flight
+
+    async def start(self) -> None:
+        if self._task is None:
+            async with self.session_factory() as db:
+                dialect = db.get_bind().dialect.name
+            if dialect not in SEQUENCE_DIALECTS:
+                self.disabled_reason = f"{dialect} has no sequence to reserve ids from"
+                logger.warning("Write-behind not started: %s; writing synchronously", self.disabled_reason)
+                return
+            self.disabled_reason = None
+            self._stopping = False
+            # Fresh allocator: its lock belongs to the running event loop,
+            # and any ids left over from a previous run are simply skipped.
+            self.ids = IdAllocator(self.session_factory, self.ids.block_size)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="write-behind")
+
+    async def stop(self) -> None:
+        """Stop accepting rows and write everything still queued."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await self._task
+        except Exception:
+            logger.exception("Write-behind flusher failed; draining the queue")
+        finally:
+            self._task = None
+        for _ in range(DRAIN_ATTEMPTS):
+            if not self._rows:
+                break
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+        if self._rows:
+            logger.error("Dropping %d queued calculations that could not be written", len(self._rows))
+            self.failed += len(self._rows)
+            self._rows = []
+
+    async def allocate_id(self) -> int:
+        return await self.ids.next_id()
+
+    def enqueue(self, row: dict) -> None:
+        # Refusing once stopped means nothing is left behind after the drain.
+        if not self.running or self.pending >= self.max_pending:
+            self.rejected += 1
+            raise QueueFull()
+        self._rows.append(row)
+        self.enqueued += 1
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Keep the loop alive: the rows are still queued for the next try.
+                self.last_error = str(e)
+                logger.exception("Write-behind flush failed")
+
+    async def flush(self) -> None:
+        while self._rows:
+            rows, self._rows = self._rows[:self.batch_size], self._rows[self.batch_size:]
+            self._in_flight = len(rows)
+            try:
+                await self._write(rows)
+            except IntegrityError:
+                # One bad row (say, for a user deleted since it was queued)
+                # must not take the rest of the batch down with it.
+                for row in rows:
+                    try:
+                        await self._write([row])
+                    except Exception as e:
+                        self.failed += 1
+                        self.last_error = str(e.orig if getattr(e, "orig", None) else e)
+                        logger.error("Dropping calculation %s: %s", row["id"], self.last_error)
+            except Exception as e:
+                # The database is unreachable (or something unexpected went
+                # wrong): keep the rows and try again on the next trigger.
+                self._rows[:0] = rows
+                self.retries += 1
+                self.last_error = str(e)
+                logger.warning("Write-behind flush of %d rows failed, will retry: %s", len(rows), e)
+                return
+            finally:
+                self._in_flight = 0
+
+    async def _write(self, rows) -> None:
+        async with self.session_factory() as db:
+            await db.execute(insert(models.Calculation), rows)
+            delta = stats.StatsDelta()
+            for row in rows:
+                delta.add(row["user_id"], row["operation"], row["result"])
+            await db.execute(delta.statement(db.get_bind().dialect.name))
+            await db.commit()
+        self.flushes += 1
+        self.flushed += len(rows)
+        for row in rows:
+            metrics.calculations_created.inc(row["operation"])
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": WRITE_BEHIND,
+            "running": self.running,
+            "disabled_reason": self.disabled_reason,
+            "pending": self.pending,
+            "capacity": self.max_pending,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "retries": self.retries,
+            "last_error": self.last_error,
+        }
+
+
+writer = WriteBehindQueue()
+
+
+def _metrics():
+    return [
+        metrics.family("write_behind_pending", "gauge", "Calculations queued and not yet committed.",
+                       [["write_behind_pending", {}, writer.pending]]),
+        metrics.family("write_behind_enqueued_total", "counter", "Calculations accepted into the queue.",
+                       [["write_behind_enqueued_total", {}, writer.enqueued]]),
+        metrics.family("write_behind_flushed_total", "counter", "Queued calculations committed.",
+                       [["write_behind_flushed_total", {}, writer.flushed]]),
+        metrics.family("write_behind_failed_total", "counter", "Queued calculations that could not be written.",
+                       [["write_behind_failed_total", {}, writer.failed]]),
+        metrics.family("write_behind_rejected_total", "counter", "Calculations refused because the queue was full.",
+                       [["write_behind_rejected_total", {}, writer.rejected]]),
+    ]
+
+
+metrics.registry.register_collector(_metrics)
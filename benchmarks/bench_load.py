@@ -0,0 +1,295 @@
+"""Load-test the HTTP routes and compare the latencies with a saved baseline.
+
+Requests are driven with an httpx ``AsyncClient``, either into the ASGI
+application in this process (the default, against a scratch SQLite database)
+or at a running server given with ``--url``. Before the clock starts, a
+benchmark user is registered and logged in and ``--seed-rows`` calculations
+are created through ``POST /calculations/batch``. Then ``--concurrency``
+workers send ``--requests`` requests, each picking a scenario at random:
+``--write-ratio`` of them from the write scenarios and the rest from the
+read scenarios.
+
+The report gives throughput and p50/p95/p99 latency per route. ``--save``
+writes it as a JSON baseline. ``--baseline`` compares the run with one, and
+the command exits with status 1 when a route's p50 or p95, or the total
+throughput, is worse by more than ``--threshold``.
+
+Usage: python -m benchmarks.bench_load [--url http://localhost:8000] [--requests 2000]
+       [--concurrency 32] [--write-ratio 0.1] [--save FILE | --baseline FILE]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+OPERATIONS = ["add", "subtract", "multiply", "divide"]
+PASSWORD = "benchmark-password"
+SEED_BATCH_SIZE = 1000
+SQLITE_BUSY_TIMEOUT = 30.0
+
+
+class Context:
+    """What the scenarios need: the seeded user, its token and calculation ids."""
+
+    def __init__(self, user_id: int, email: str, token: str, calculation_ids, rng: random.Random):
+        self.user_id = user_id
+        self.email = email
+        self.token = token
+        self.calculation_ids = list(calculation_ids)
+        self.rng = rng
+
+    @property
+    def auth(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def calculation(self) -> dict:
+        return {"operation": self.rng.choice(OPERATIONS), "operand_a": self.rng.uniform(-1000, 1000),
+                "operand_b": self.rng.uniform(1, 1000)}
+
+
+# Each scenario is (route label, "read" or "write", weight within its kind,
+# function building the keyword arguments for ``client.request``).
+SCENARIOS = [
+    ("GET /calculations", "read", 4, lambda ctx: {
+        "method": "GET", "url": "/calculations", "params": {"limit": 50}, "headers": ctx.auth}),
+    ("GET /calculations/{id}", "read", 4, lambda ctx: {
+        "method": "GET", "url": f"/calculations/{ctx.rng.choice(ctx.calculation_ids)}", "headers": ctx.auth}),
+    ("GET /users/{id}/stats", "read", 1, lambda ctx: {
+        "method": "GET", "url": f"/users/{ctx.user_id}/stats", "headers": ctx.auth}),
+    ("GET /api/{operation}", "read", 2, lambda ctx: {
+        "method": "GET", "url": f"/api/{ctx.rng.choice(OPERATIONS)}",
+        "params": {"a": ctx.rng.randint(0, 100), "b": ctx.rng.randint(1, 100)}}),
+    ("POST /api/evaluate", "read", 1, lambda ctx: {
+        "method": "POST", "url": "/api/evaluate",
+        "json": {"expression": "(a + b) * c / d",
+                 "bindings": [{"a": ctx.rng.uniform(0, 100), "b": 2, "c": 3, "d": 4}]}}),
+    ("POST /calculations", "write", 6, lambda ctx: {
+        "method": "POST", "url": "/calculations", "json": ctx.calculation(), "headers": ctx.auth}),
+    ("PUT /calculations/{id}", "write", 3, lambda ctx: {
+        "method": "PUT", "url": f"/calculations/{ctx.rng.choice(ctx.calculation_ids)}",
+        "json": {"operand_a": ctx.rng.uniform(-1000, 1000)}, "headers": ctx.auth}),
+    # Login is dominated by password hashing, so it gets a small share.
+    ("POST /users/login", "write", 1, lambda ctx: {
+        "method": "POST", "url": "/users/login", "json": {"email": ctx.email, "password": PASSWORD}}),
+]
+
+
+def percentile(ordered, fraction: float) -> float:
+    """Linear interpolation between the closest ranks of a sorted list."""
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def pick_weights(write_ratio: float, routes=None):
+    """Scenarios and their probabilities for the requested read/write mix."""
+    scenarios = [s for s in SCENARIOS if routes is None or s[0] in routes]
+    totals = defaultdict(float)
+    for _, kind, weight, _ in scenarios:
+        totals[kind] += weight
+    share = {"read": 1 - write_ratio, "write": write_ratio}
+    # With only reads (or only writes) selected, that kind takes the whole mix.
+    if not totals["write"]:
+        share = {"read": 1.0, "write": 0.0}
+    elif not totals["read"]:
+        share = {"read": 0.0, "write": 1.0}
+    return scenarios, [share[kind] * weight / totals[kind] for _, kind, weight, _ in scenarios]
+
+
+async def seed(client: httpx.AsyncClient, rows: int, rng: random.Random) -> Context:
+    suffix = uuid.uuid4().hex[:12]
+    email = f"bench-{suffix}@example.com"
+    response = await client.post("/users/register",
+                                 json={"email": email, "username": f"bench-{suffix}", "password": PASSWORD})
+    response.raise_for_status()
+    response = await client.post("/users/login", json={"email": email, "password": PASSWORD})
+    response.raise_for_status()
+    login = response.json()
+    ctx = Context(login["id"], email, login["access_token"], [], rng)
+
+    for start in range(0, max(rows, 1), SEED_BATCH_SIZE):
+        batch = [ctx.calculation() for _ in range(min(SEED_BATCH_SIZE, max(rows, 1) - start))]
+        response = await client.post("/calculations/batch", json=batch, headers=ctx.auth)
+        response.raise_for_status()
+        ctx.calculation_ids.extend(response.json()["created_ids"])
+    return ctx
+
+
+async def run(client: httpx.AsyncClient, ctx: Context, requests: int, concurrency: int,
+              write_ratio: float, routes=None) -> dict:
+    """Send ``requests`` requests from ``concurrency`` workers and summarise them."""
+    scenarios, weights = pick_weights(write_ratio, routes)
+    plan = ctx.rng.choices(scenarios, weights=weights, k=requests)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    position = 0
+
+    async def worker():
+        nonlocal position
+        while position < len(plan):
+            label, _, _, build = plan[position]
+            position += 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(**build(ctx))
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            latencies[label].append(time.perf_counter() - started)
+            if failed:
+                errors[label] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return summarise(latencies, errors, elapsed)
+
+
+def summarise(latencies, errors, elapsed: float) -> dict:
+    def stats(samples, failed):
+        ordered = sorted(samples)
+        return {
+            "requests": len(ordered),
+            "errors": failed,
+            "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        }
+
+    routes = {label: stats(samples, errors[label]) for label, samples in sorted(latencies.items())}
+    everything = [sample for samples in latencies.values() for sample in samples]
+    return {"elapsed_seconds": round(elapsed, 3), "routes": routes,
+            "total": stats(everything, sum(errors.values()))}
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta_ms: float = 1.0):
+    """Regressions of ``current`` against ``baseline`` as human-readable lines.
+
+    A latency only counts when it is both ``threshold`` (a fraction) and
+    ``min_delta_ms`` worse, so sub-millisecond routes do not flap on noise.
+    """
+    regressions = []
+    for label, now in current["routes"].items():
+        before = baseline["routes"].get(label)
+        if before is None:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if now[key] > before[key] * (1 + threshold) and now[key] - before[key] > min_delta_ms:
+                regressions.append(f"{label} {key}: {before[key]} -> {now[key]}")
+    before_rps, now_rps = baseline["total"]["rps"], current["total"]["rps"]
+    if now_rps < before_rps * (1 - threshold):
+        regressions.append(f"total rps: {before_rps} -> {now_rps}")
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    print(f"{'route':<26}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, row in [*report["routes"].items(), ("total", report["total"])]:
+        print(f"{label:<26}{row['requests']:>9}{row['errors']:>8}{row['rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+@contextlib.asynccontextmanager
+async def open_client(url, directory: str, timeout: float):
+    if url is not None:
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as client:
+            yield client
+        return
+
+    # The database settings are read at import time, so point them at a
+    # scratch file before the application is imported.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.setdefault("APP_ENV", "development")
+    from sqlalchemy import event, text
+
+    from app.database import Base, async_engine, engine
+    from app.main import app
+
+    # WAL lets reads run alongside the single writer, and the busy timeout
+    # makes concurrent writers wait for the lock instead of failing, so the
+    # default mix measures latency rather than lock errors.
+    def set_busy_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}")
+        cursor.close()
+
+    for sync_engine in (engine, async_engine.sync_engine):
+        event.listen(sync_engine, "connect", set_busy_timeout)
+    with engine.connect() as connection:
+        connection.execute(text("PRAGMA journal_mode = WAL"))
+    Base.metadata.create_all(bind=engine)
+    # A failing request is counted as an error instead of aborting the run.
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+            yield client
+
+
+async def bench(args) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        async with open_client(args.url, directory, args.timeout) as client:
+            ctx = await seed(client, args.seed_rows, rng)
+            if args.warmup:
+                await run(client, ctx, args.warmup, args.concurrency, args.write_ratio, args.routes)
+            report = await run(client, ctx, args.requests, args.concurrency, args.write_ratio, args.routes)
+    report["config"] = {
+        "target": args.url or "in-process",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "write_ratio": args.write_ratio,
+        "seed_rows": args.seed_rows,
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running server; default drives the app in-process")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200, help="requests sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--routes", nargs="+", help="only these route labels, e.g. 'GET /calculations'")
+    parser.add_argument("--seed-rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the request mix")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--save", help="write the report to this JSON file")
+    parser.add_argument("--baseline", help="compare with this JSON report")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown as a fraction")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(bench(args))
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(json.load(baseline_file), report, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Compare CPU cost of the default and fast JSON paths for calculation pages.
+
+Seeds an in-memory SQLite database and, for each path, measures the process
+CPU time to load N rows and turn them into a JSON body:
+
+* default: ORM objects -> response-model validation -> jsonable_encoder -> json
+* columns: column-only rows -> response-model validation -> jsonable_encoder -> json
+* fast:    column-only rows -> orjson
+
+Usage: python -m benchmarks.bench_serialization [--rows 10000] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app import models, schemas
+from app.database import Base
+from app.main import CALCULATION_COLUMNS
+
+PAGE_ADAPTER = TypeAdapter(List[schemas.CalculationRead])
+
+
+def seed(rows: int):
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    start = datetime(2024, 1, 1)
+    with Session(engine) as db:
+        db.execute(insert(models.User), [{"id": 1, "email": "bench@example.com", "username": "bench", "hashed_password": "x"}])
+        db.execute(insert(models.Calculation), [
+            {"operation": "add", "operand_a": i, "operand_b": 0.5, "result": i + 0.5, "user_id": 1,
+             "created_at": start + timedelta(seconds=i)}
+            for i in range(rows)
+        ])
+        db.commit()
+    return engine
+
+
+def default_path(db: Session) -> bytes:
+    calculations = db.scalars(select(models.Calculation)).all()
+    validated = PAGE_ADAPTER.validate_python(calculations, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+
+def columns_path(db: Session) -> bytes:
+    rows = db.execute(select(*CALCULATION_COLUMNS)).all()
+    validated = PAGE_ADAPTER.validate_python(rows, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+
+def fast_path(db: Session) -> bytes:
+    rows = db.execute(select(*CALCULATION_COLUMNS)).all()
+    return orjson.dumps([row._asdict() for row in rows])
+
+
+def measure(engine, func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        with Session(engine) as db:
+            started = time.process_time()
+            func(db)
+            best = min(best, time.process_time() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = seed(args.rows)
+    with Session(engine) as db:
+        assert json.loads(default_path(db)) == json.loads(fast_path(db))
+
+    baseline = measure(engine, default_path, args.repeat)
+    print(f"{'path':<10}{'CPU ms per ' + str(args.rows) + ' rows':>26}{'saved':>10}")
+    for name, func in (("default", default_path), ("columns", columns_path), ("fast", fast_path)):
+        elapsed = baseline if func is default_path else measure(engine, func, args.repeat)
+        print(f"{name:<10}{elapsed * 1000:>26.1f}{(1 - elapsed / baseline) * 100:>9.0f}%")
+
+
+if __name__ == "__main__":
+    main()
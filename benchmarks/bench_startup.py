@@ -0,0 +1,68 @@
+"""Measure the cold start of a fresh process, up to its first served request.
+
+Each run starts a new interpreter that imports the application, runs the
+lifespan handler and serves one ``GET /calculations`` against a scratch
+SQLite database, and reports the wall time for each step. The test client
+itself is imported before the clock starts. ``--create-all``
+adds the import-time ``create_all`` the application used to run, for a
+before/after comparison.
+
+Usage: python -m benchmarks.bench_startup [--runs 5] [--create-all]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = """
+import json, sys, time
+from fastapi.testclient import TestClient
+started = time.perf_counter()
+import app.main
+if sys.argv[1] == "1":
+    app.database.Base.metadata.create_all(bind=app.database.engine)
+imported = time.perf_counter()
+with TestClient(app.main.app) as client:
+    ready = time.perf_counter()
+    token = app.auth.create_access_token(1)
+    assert client.get("/calculations", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    served = time.perf_counter()
+print(json.dumps({"import": imported - started, "lifespan": ready - imported,
+                  "first_request": served - ready, "total": served - started}))
+"""
+
+
+def run_once(database_url: str, create_all: bool) -> dict:
+    env = {"APP_ENV": "development", **os.environ, "DATABASE_URL": database_url}
+    env.pop("ASYNC_DATABASE_URL", None)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, "1" if create_all else "0"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--create-all", action="store_true", help="also run create_all at import, as before")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+        subprocess.run([sys.executable, "init_db.py"], env={**os.environ, "DATABASE_URL": database_url},
+                       capture_output=True, check=True)
+        runs = [run_once(database_url, args.create_all) for _ in range(args.runs)]
+
+    print(f"{'step':<15}{'median ms':>12}{'max ms':>10}")
+    for step in ("import", "lifespan", "first_request", "total"):
+        values = [run[step] * 1000 for run in runs]
+        print(f"{step:<15}{statistics.median(values):>12.1f}{max(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import sys
+
+from app.database import SessionLocal
+from app.importer import CalculationImporter, DEFAULT_CHUNK_SIZE, FORMATS
+
+READ_SIZE = 1024 * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream calculations from an NDJSON or CSV file into the database.")
+    parser.add_argument("path", help="file to import, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, help="input format (default: from the file extension)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows validated and written per transaction")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+
+    db = SessionLocal()
+    try:
+        calculation_importer = CalculationImporter(db, fmt=fmt, chunk_size=args.chunk_size)
+        with source:
+            for data in iter(lambda: source.read(READ_SIZE), b""):
+                calculation_importer.feed(data)
+        report = calculation_importer.finish()
+    finally:
+        db.close()
+
+    print(f"Imported {report.imported} rows in {report.elapsed_seconds:.2f}s ({report.rows_per_second:.0f} rows/sec)")
+    print(f"Rejected {report.rejected} rows")
+    for rejection in report.rejections:
+        print(f"  line {rejection.line}: {rejection.detail}")
+    return 1 if report.rejected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
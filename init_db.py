@@ -1,3 +1,9 @@
-from app.database import engine, Base
-Base.metadata.create_all(bind=engine)
+from app import models  # registers the tables on models.Base.metadata
+from app.database import engine
+models.Base.metadata.create_all(bind=engine)
+# create_all skips tables that already exist, so add any indexes declared
+# since those tables were created.
+for table in models.Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
 print('Database created''')
@@ -0,0 +1,29 @@
+import argparse
+import sys
+
+from app.database import SessionLocal
+from app.stats import check_stats, rebuild_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the per-user calculation stats table.")
+    parser.add_argument("--check", action="store_true", help="only report rows that disagree with the calculations table")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.check:
+            mismatches = check_stats(db)
+            for user_id, operation, stored, expected in mismatches:
+                print(f"user {user_id} {operation}: stored {stored}, expected {expected}")
+            print(f"{len(mismatches)} mismatched rows")
+            return 1 if mismatches else 0
+
+        print(f"Rebuilt {rebuild_stats(db)} stats rows")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+import os
+
+# The application refuses to start without JWT_SECRET_KEY outside a
+# development or test setup.
+os.environ.setdefault("APP_ENV", "test")
+# TestClient runs each request on a new event loop, and pooled asyncpg
+# connections cannot be reused on another loop.
+os.environ.setdefault("DB_ASYNC_POOL", "null")
@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.main import app
+from app import admission, auth
+
+client = TestClient(app)
+
+
+def install(monkeypatch, **limits):
+    options = dict(max_in_flight=0, auth_concurrency=0, auth_queue=0, write_concurrency=0, write_queue=0,
+                   user_rate=0, ip_rate=0, backend=admission.MemoryBackend())
+    options.update(limits)
+    controller = admission.AdmissionController(enabled=True, **options)
+    monkeypatch.setattr(admission, "controller", controller)
+    return controller
+
+
+def test_defaults_admit_normal_traffic():
+    """Test the default limits let ordinary requests through"""
+    for _ in range(50):
+        assert client.get("/api/add", params={"a": 1, "b": 2}).status_code == 200
+    health = client.get("/health/admission").json()
+    assert health["enabled"] is True
+    assert health["in_flight"] == 0
+    assert health["route_limits"]["auth"] > 0 and health["route_limits"]["write"] > 0
+
+
+def test_ip_rate_limit(monkeypatch):
+    """Test a client over its token bucket gets 429 with Retry-After"""
+    controller = install(monkeypatch, ip_rate=0.5, ip_burst=3)
+    statuses = [client.get("/api/add", params={"a": 1, "b": 2}).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    response = client.get("/api/add", params={"a": 1, "b": 2})
+    assert response.json() == {"detail": "Too many requests"}
+    assert response.headers["retry-after"] == "2"
+    assert controller.rejected["ip_rate"] == 2
+    assert client.get("/health/admission").status_code == 200
+    assert "admission_rejected_total{reason=\"ip_rate\"}" in client.get("/metrics").text
+
+
+def test_user_buckets_follow_the_token_owner(monkeypatch):
+    """Test tokens of one user share a bucket and anonymous callers are limited per address"""
+    install(monkeypatch, user_rate=0.1, user_burst=2)
+    first = {"Authorization": f"Bearer {auth.create_access_token(1)}"}
+    # A fresh login for the same user must not bring a fresh bucket.
+    token = jwt.encode({"sub": "1", "exp": datetime.utcnow() + timedelta(hours=1)}, auth.JWT_SECRET_KEY,
+                       algorithm=auth.JWT_ALGORITHM)
+    again = {"Authorization": f"Bearer {token}"}
+    other = {"Authorization": f"Bearer {auth.create_access_token(2)}"}
+    assert client.get("/api/add?a=1&b=1", headers=first).status_code == 200
+    assert client.get("/api/add?a=1&b=1", headers=again).status_code == 200
+    assert client.get("/api/add?a=1&b=1", headers=first).status_code == 429
+    assert client.get("/api/add?a=1&b=1", headers=other).status_code == 200
+    statuses = [client.get("/api/add?a=1&b=1").status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    # An invalid token counts as anonymous.
+    assert client.get("/api/add?a=1&b=1", headers={"Authorization": "Bearer junk"}).status_code == 429
+
+
+def test_concurrency_limits(monkeypatch):
+    """Test the per-route and global caps shed requests with 503 while others run"""
+    controller = install(monkeypatch, max_in_flight=3, auth_concurrency=1, write_concurrency=1)
+    release = asyncio.Event()
+    started = []
+
+    async def slow_app(scope, receive, send):
+        started.append(scope["path"])
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = admission.AdmissionMiddleware(slow_app, controller)
+
+    async def request(method, path):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "headers": [], "client": ("10.0.0.1", 1)}
+        await middleware(scope, None, send)
+        return messages[0]["status"], dict(messages[0]["headers"]).get(b"retry-after")
+
+    async def scenario():
+        login = asyncio.create_task(request("POST", "/users/login"))
+        write = asyncio.create_task(request("POST", "/calculations"))
+        await asyncio.sleep(0)
+        busy = [await request("POST", "/users/register"), await request("PUT", "/calculations/1")]
+        read = asyncio.create_task(request("GET", "/calculations"))
+        await asyncio.sleep(0)
+        full = await request("GET", "/api/add")
+        release.set()
+        return busy, full, await asyncio.gather(login, write, read)
+
+    busy, full, admitted = asyncio.run(scenario())
+    assert busy == [(503, b"1"), (503, b"1")]
+    assert full == (503, b"1")
+    assert [status for status, _ in admitted] == [200, 200, 200]
+    assert started == ["/users/login", "/calculations", "/calculations"]
+    assert controller.rejected == {"in_flight": 1, "auth": 1, "write": 1, "user_rate": 0, "ip_rate": 0}
+    assert controller.in_flight == 0 and controller.route_in_flight == {"auth": 0, "write": 0}
+
+
+async def run_requests(middleware, requests):
+    async def request(method, path):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "headers": [], "client": ("10.0.0.1", 1)}
+        await middleware(scope, None, send)
+        return messages[0]["status"]
+
+    return await asyncio.gather(*(request(method, path) for method, path in requests))
+
+
+def test_writes_over_the_limit_wait_for_a_slot(monkeypatch):
+    """Test a write burst queues behind the limit instead of being shed"""
+    controller = install(monkeypatch, write_concurrency=2, write_queue=10)
+    running = []
+    peak = []
+
+    async def slow_app(scope, receive, send):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.001)
+        running.pop()
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = admission.AdmissionMiddleware(slow_app, controller)
+    statuses = asyncio.run(run_requests(middleware, [("POST", "/calculations")] * 12))
+    assert statuses.count(201) == 12
+    assert max(peak) == 2
+    statuses = asyncio.run(run_requests(middleware, [("POST", "/calculations")] * 13))
+    assert statuses.count(503) == 1
+    assert controller.in_flight == 0 and controller.route_in_flight["write"] == 0
+
+
+def test_global_cap_holds_across_awaited_rate_checks(monkeypatch):
+    """Test requests that await a shared backend cannot overshoot the in-flight cap"""
+    class SlowBackend(admission.RateLimitBackend):
+        async def take(self, key, rate, burst):
+            await asyncio.sleep(0)
+            return 0.0
+
+    controller = install(monkeypatch, max_in_flight=3, ip_rate=1000, ip_burst=1000, backend=SlowBackend())
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = admission.AdmissionMiddleware(slow_app, controller)
+
+    async def scenario():
+        burst = asyncio.ensure_future(run_requests(middleware, [("GET", "/calculations")] * 10))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert controller.in_flight == 3
+        release.set()
+        return await burst
+
+    statuses = asyncio.run(scenario())
+    assert statuses.count(200) == 3 and statuses.count(503) == 7
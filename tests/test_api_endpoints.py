@@ -44,3 +44,110 @@ def test_divide_by_zero():
     response = client.get("/api/divide?a=10&b=0")
     assert response.status_code == 400
     assert "detail" in response.json()
+
+
+def test_vector_endpoint():
+    """Test /api/vector with per-element errors"""
+    response = client.post(
+        "/api/vector",
+        json={"operation": "divide", "a": [10, 1, 1e308], "b": [4, 0, 1e-308]},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["results"] == [2.5, None, None]
+    assert data["errors"] == [
+        {"index": 1, "detail": "Division by zero is not allowed"},
+        {"index": 2, "detail": "Result is not a finite number"},
+    ]
+
+
+def test_vector_endpoint_operations():
+    """Test /api/vector with one operation per element"""
+    response = client.post(
+        "/api/vector",
+        json={"operations": ["add", "multiply"], "a": [1, 2], "b": [2, 3]},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"results": [3, 6], "errors": []}
+
+
+def test_vector_endpoint_invalid():
+    """Test /api/vector input validation"""
+    response = client.post("/api/vector", json={"a": [1], "b": [2]})
+    assert response.status_code == 422
+
+    response = client.post("/api/vector", json={"operation": "add", "a": [1, 2], "b": [2]})
+    assert response.status_code == 400
+
+
+def test_pool_health_endpoint():
+    """Test /health/pool reports stats for both engines"""
+    response = client.get("/health/pool")
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data) == {"sync", "async"}
+    for stats in data.values():
+        assert stats["checkouts"] >= stats["checkins"] >= 0
+        assert "+Inf" in stats["checkout_latency_seconds"]["buckets"]
+
+
+def test_api_caching_headers():
+    """Test /api/* responses carry caching headers and honour If-None-Match"""
+    response = client.get("/api/multiply?a=3&b=7")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert "max-age" in response.headers["Cache-Control"]
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+    response = client.get("/api/multiply?a=3&b=7", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    response = client.get("/api/multiply?a=3&b=8", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_api_if_none_match_star_does_not_hide_errors():
+    """Test If-None-Match: * still gets a 400 for an invalid calculation"""
+    response = client.get("/api/divide?a=1&b=0", headers={"If-None-Match": "*"})
+    assert response.status_code == 400
+    assert client.get("/api/divide?a=1&b=2", headers={"If-None-Match": "*"}).status_code == 304
+
+
+def test_api_result_cache():
+    """Test repeated /api/* calls are served from the result cache"""
+    before = client.get("/health/result-cache").json()
+    client.get("/api/subtract?a=123&b=45")
+    client.get("/api/subtract?a=123&b=45")
+    after = client.get("/health/result-cache").json()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+
+def test_evaluate_endpoint():
+    """Test /api/evaluate with many bindings"""
+    response = client.post(
+        "/api/evaluate",
+        json={
+            "expression": "(a + b) * c / d",
+            "bindings": [
+                {"a": 1, "b": 2, "c": 4, "d": 3},
+                {"a": 1, "b": 2, "c": 4, "d": 0},
+                {"a": 1},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["variables"] == ["a", "b", "c", "d"]
+    assert data["results"] == [4, None, None]
+    assert [e["index"] for e in data["errors"]] == [1, 2]
+
+
+def test_evaluate_endpoint_invalid_expression():
+    """Test /api/evaluate rejects unsupported syntax"""
+    response = client.post("/api/evaluate", json={"expression": "open('x')"})
+    assert response.status_code == 400
+    response = client.post("/api/evaluate", json={"expression": "9" * 400 + " + a"})
+    assert response.status_code == 400
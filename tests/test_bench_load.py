@@ -0,0 +1,86 @@
+import asyncio
+import random
+
+import httpx
+
+from app.main import app
+from app.database import Base, engine, SessionLocal
+from app import cache, models
+from benchmarks import bench_load
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+
+
+def teardown_module():
+    db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
+    db.query(models.Calculation).delete()
+    db.query(models.User).delete()
+    db.commit()
+    db.close()
+    cache.calculation_cache = cache.CalculationCache(cache.MemoryBackend())
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_percentile():
+    """Test percentiles interpolate between ranks"""
+    assert bench_load.percentile([], 0.5) == 0.0
+    assert bench_load.percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.5
+    assert round(bench_load.percentile([1.0, 2.0, 3.0, 4.0], 0.99), 6) == 3.97
+
+
+def test_mix_follows_write_ratio():
+    """Test the write ratio splits the probabilities between reads and writes"""
+    scenarios, weights = bench_load.pick_weights(0.25)
+    writes = sum(weight for scenario, weight in zip(scenarios, weights) if scenario[1] == "write")
+    assert round(sum(weights), 9) == 1 and round(writes, 9) == 0.25
+    scenarios, weights = bench_load.pick_weights(0.25, routes=["GET /calculations"])
+    assert [s[0] for s in scenarios] == ["GET /calculations"] and weights == [1.0]
+
+
+def test_compare_flags_regressions():
+    """Test only slowdowns past the threshold and the noise floor are regressions"""
+    baseline = {"routes": {"GET /calculations": {"p50_ms": 10.0, "p95_ms": 20.0},
+                           "GET /api/{operation}": {"p50_ms": 0.2, "p95_ms": 0.4}},
+                "total": {"rps": 1000.0}}
+    current = {"routes": {"GET /calculations": {"p50_ms": 11.0, "p95_ms": 30.0},
+                          "GET /api/{operation}": {"p50_ms": 0.5, "p95_ms": 0.9}},
+               "total": {"rps": 850.0}}
+    assert bench_load.compare(baseline, current, 0.2) == ["GET /calculations p95_ms: 20.0 -> 30.0"]
+    current["total"]["rps"] = 700.0
+    assert bench_load.compare(baseline, current, 0.2)[-1] == "total rps: 1000.0 -> 700.0"
+
+
+def test_run_in_process():
+    """Test a short in-process run reports every route it exercised"""
+    async def go():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            ctx = await bench_load.seed(client, 20, random.Random(0))
+            routes = [label for label, kind, _, _ in bench_load.SCENARIOS if label != "POST /users/login"]
+            return ctx, await bench_load.run(client, ctx, 60, 4, 0.3, routes)
+
+    ctx, report = asyncio.run(go())
+    assert len(ctx.calculation_ids) == 20
+    assert report["total"]["requests"] == 60
+    assert report["total"]["errors"] == 0
+    assert set(report["routes"]) <= {label for label, _, _, _ in bench_load.SCENARIOS}
+    assert all(row["p50_ms"] <= row["p95_ms"] <= row["p99_ms"] for row in report["routes"].values())
+
+
+def test_run_counts_app_exceptions_as_errors():
+    """Test an exception raised by the application is an error, not the end of the run"""
+    async def broken_app(scope, receive, send):
+        raise RuntimeError("database is locked")
+
+    async def go():
+        transport = httpx.ASGITransport(app=broken_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            ctx = bench_load.Context(1, "x@example.com", "token", [1], random.Random(0))
+            return await bench_load.run(client, ctx, 10, 2, 0.0, ["GET /calculations"])
+
+    report = asyncio.run(go())
+    assert report["total"]["requests"] == 10
+    assert report["total"]["errors"] == 10
@@ -0,0 +1,165 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.database import Base, engine, SessionLocal
+from app.cache import CalculationCache, MemoryBackend
+from app import auth, cache, models
+
+client = TestClient(app)
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+
+
+def teardown_module():
+    Base.metadata.drop_all(bind=engine)
+
+
+def clear_db():
+    db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
+    db.query(models.Calculation).delete()
+    db.query(models.User).delete()
+    db.commit()
+    db.close()
+    cache.calculation_cache = CalculationCache(MemoryBackend())
+    client.headers.pop("Authorization", None)
+
+
+def create_calculation():
+    db = SessionLocal()
+    user = models.User(email="cache@example.com", username="cache", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    client.headers["Authorization"] = f"Bearer {auth.create_access_token(user_id)}"
+    response = client.post("/calculations", json={"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id})
+    return response.json()["id"]
+
+
+def db_queries(response):
+    return response.headers["Server-Timing"].split('desc="')[1].split(" ")[0]
+
+
+def test_second_read_is_served_from_cache():
+    """Test repeated reads of a calculation skip the database"""
+    clear_db()
+    calc_id = create_calculation()
+
+    first = client.get(f"/calculations/{calc_id}")
+    second = client.get(f"/calculations/{calc_id}")
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert db_queries(first) == "1"
+    assert db_queries(second) == "0"
+
+    health = client.get("/health/calculation-cache").json()
+    assert health["hits"] == 1 and health["misses"] == 1
+    assert health["hit_ratio"] == 0.5
+    assert "calculation_cache_hits_total 1.0" in client.get("/metrics").text
+
+
+def test_edit_and_delete_invalidate():
+    """Test edits and deletes are visible on the next read"""
+    clear_db()
+    calc_id = create_calculation()
+    assert client.get(f"/calculations/{calc_id}").json()["result"] == 3
+
+    client.put(f"/calculations/{calc_id}", json={"operation": "multiply"})
+    assert client.get(f"/calculations/{calc_id}").json()["result"] == 2
+
+    client.delete(f"/calculations/{calc_id}")
+    assert client.get(f"/calculations/{calc_id}").status_code == 404
+
+
+def test_cached_rows_stay_scoped_to_owner():
+    """Test a cached calculation is not served to another user's token"""
+    clear_db()
+    calc_id = create_calculation()
+    client.get(f"/calculations/{calc_id}")
+
+    client.post("/users/register", json={"email": "peer@example.com", "username": "peer", "password": "secret123"})
+    token = client.post("/users/login", json={"email": "peer@example.com", "password": "secret123"}).json()["access_token"]
+    response = client.get(f"/calculations/{calc_id}", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404
+
+
+def test_memory_cache_is_default_only_for_one_worker():
+    """Test several workers default to no cache rather than per-worker copies"""
+    assert cache.default_backend_name({}) == "memory"
+    assert cache.default_backend_name({"WEB_CONCURRENCY": "1"}) == "memory"
+    assert cache.default_backend_name({"WEB_CONCURRENCY": "4"}) == "off"
+    assert cache.default_backend_name({"WEB_CONCURRENCY": "4", "CALCULATION_CACHE": "Redis"}) == "redis"
+
+
+def test_lru_and_ttl():
+    """Test the memory backend evicts least recently used and expired entries"""
+    backend = MemoryBackend(max_entries=2, ttl=0.05)
+
+    async def scenario():
+        for key in ("a", "b"):
+            await backend.set_if_version(key, key.encode(), 0)
+        await backend.get("a")
+        await backend.set_if_version("c", b"c", 0)
+        assert await backend.get("b") is None
+        assert await backend.get("a") == b"a"
+        time.sleep(0.06)
+        assert await backend.get("a") is None
+
+    asyncio.run(scenario())
+    assert backend.snapshot()["evictions"] == 1
+    assert backend.snapshot()["expirations"] == 1
+
+
+def test_shared_backend_invalidation_and_races():
+    """Test workers sharing a backend see each other's invalidations and stale fills are refused"""
+    shared = MemoryBackend()
+    worker_a, worker_b = CalculationCache(shared), CalculationCache(shared)
+
+    async def scenario():
+        await worker_a.fill(7, b"old", await worker_a.version(7))
+        assert await worker_b.get(7) == b"old"
+        await worker_b.invalidate(7)
+        assert await worker_a.get(7) is None
+
+        # worker_a reads the old row, worker_b edits and invalidates, then
+        # worker_a tries to store what it read.
+        version = await worker_a.version(7)
+        await worker_b.invalidate(7)
+        assert await worker_a.fill(7, b"stale", version) is False
+        assert await worker_a.get(7) is None
+
+    asyncio.run(scenario())
+
+
+def test_delayed_invalidation_is_tracked_and_logged(monkeypatch, caplog):
+    """Test the second invalidation after replica lag is kept alive and its failure logged"""
+    from app import database, main
+
+    class FlakyBackend(MemoryBackend):
+        calls = 0
+
+        async def invalidate(self, key):
+            FlakyBackend.calls += 1
+            if FlakyBackend.calls == 2:
+                raise ConnectionError("redis went away")
+            await super().invalidate(key)
+
+    monkeypatch.setattr(cache, "calculation_cache", CalculationCache(FlakyBackend()))
+    monkeypatch.setattr(database.read_router, "replicas", [object()])
+    monkeypatch.setattr(database, "READ_YOUR_WRITES_SECONDS", 0.01)
+
+    async def scenario():
+        await main._invalidate_cached(7)
+        assert len(main._delayed_invalidations) == 1
+        await asyncio.gather(*main._delayed_invalidations)
+
+    asyncio.run(scenario())
+    assert FlakyBackend.calls == 2
+    assert main._delayed_invalidations == set()
+    assert "Delayed cache invalidation of calculation 7 failed" in caplog.text
@@ -1,7 +1,10 @@
+import json
+from datetime import datetime, timedelta, timezone
+
 from fastapi.testclient import TestClient
 from app.main import app
 from app.database import Base, engine, SessionLocal
-from app import models
+from app import auth, cache, main, models, stats
 
 client = TestClient(app)
 
@@ -16,10 +19,18 @@ def teardown_module():
 
 def clear_db():
     db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
     db.query(models.Calculation).delete()
     db.query(models.User).delete()
     db.commit()
     db.close()
+    # Rows were removed behind the cache's back.
+    cache.calculation_cache = cache.CalculationCache(cache.MemoryBackend())
+    client.headers.pop("Authorization", None)
+
+
+def bearer(user_id):
+    return {"Authorization": f"Bearer {auth.create_access_token(user_id)}"}
 
 
 def create_user():
@@ -32,7 +43,10 @@ def create_user():
         },
     )
     assert response.status_code == 201
-    return response.json()["id"]
+    user_id = response.json()["id"]
+    # The rest of the test acts as this user.
+    client.headers.update(bearer(user_id))
+    return user_id
 
 
 def test_calculation_bread():
@@ -156,9 +170,11 @@ def test_invalid_operation():
     assert response.status_code == 400
 
 
-def test_invalid_user():
+def test_invalid_user(monkeypatch):
     """Test calculation with non-existent user"""
     clear_db()
+    # Only anonymous callers name the user, and only in legacy mode.
+    monkeypatch.setattr(auth, "ANONYMOUS_CALCULATIONS", True)
 
     response = client.post(
         "/calculations",
@@ -170,6 +186,7 @@ def test_invalid_user():
 def test_update_nonexistent_calculation():
     """Test updating non-existent calculation"""
     clear_db()
+    create_user()
 
     response = client.put(
         "/calculations/9999",
@@ -181,6 +198,7 @@ def test_update_nonexistent_calculation():
 def test_delete_nonexistent_calculation():
     """Test deleting non-existent calculation"""
     clear_db()
+    create_user()
 
     response = client.delete("/calculations/9999")
     assert response.status_code == 404
@@ -233,3 +251,467 @@ def test_partial_update():
     )
     assert response.status_code == 200
     assert response.json()["result"] == 17
+
+
+def test_browse_pagination():
+    """Test keyset pagination of calculations"""
+    clear_db()
+    user_id = create_user()
+
+    for i in range(5):
+        response = client.post(
+            "/calculations",
+            json={"operation": "add", "operand_a": i, "operand_b": 1, "user_id": user_id},
+        )
+        assert response.status_code == 201
+
+    response = client.get("/calculations?limit=2")
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/calculations?limit=2&after={cursor}")
+    assert response.status_code == 200
+    second_page = response.json()
+    assert len(second_page) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/calculations?limit=2&after={cursor}")
+    assert response.status_code == 200
+    last_page = response.json()
+    assert len(last_page) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+    ids = [c["id"] for c in first_page + second_page + last_page]
+    assert len(set(ids)) == 5
+
+
+def test_browse_filters():
+    """Test filtering calculations by user, operation and date range"""
+    clear_db()
+    user_id = create_user()
+
+    client.post(
+        "/calculations",
+        json={"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id},
+    )
+    client.post(
+        "/calculations",
+        json={"operation": "multiply", "operand_a": 3, "operand_b": 4, "user_id": user_id},
+    )
+
+    response = client.get("/calculations?operation=multiply")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["result"] == 12
+
+    response = client.get(f"/calculations?user_id={user_id}")
+    assert len(response.json()) == 2
+
+    response = client.get(f"/calculations?user_id={user_id + 1}")
+    assert response.status_code == 403
+
+    response = client.get("/calculations?created_before=2000-01-01T00:00:00")
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get("/calculations?created_after=2000-01-01T00:00:00")
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+    # Aware times are compared in UTC with the naive UTC column.
+    created_at = datetime.fromisoformat(response.json()[0]["created_at"])
+    ahead = (created_at + timedelta(hours=3)).isoformat() + "+02:00"
+    response = client.get("/calculations", params={"created_after": "2000-01-01T00:00:00+05:00", "created_before": ahead})
+    assert response.status_code == 200
+    assert response.json()[0]["created_at"] == created_at.isoformat()
+    response = client.get("/calculations", params={"created_before": created_at.isoformat() + "+00:00"})
+    assert response.json() == []
+    query = main._browse_query(10, created_after=datetime(2024, 1, 1, 12, tzinfo=timezone(timedelta(hours=2))))
+    assert query.compile().params["created_at_1"] == datetime(2024, 1, 1, 10)
+
+
+def test_browse_invalid_cursor():
+    """Test browsing with a malformed cursor"""
+    response = client.get("/calculations?after=not-a-cursor", headers=bearer(1))
+    assert response.status_code == 400
+
+
+def test_batch_create():
+    """Test batch creation with per-item errors"""
+    clear_db()
+    user_id = create_user()
+
+    response = client.post(
+        "/calculations/batch",
+        json=[
+            {"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id},
+            {"operation": "divide", "operand_a": 1, "operand_b": 0, "user_id": user_id},
+            {"operation": "modulo", "operand_a": 1, "operand_b": 2, "user_id": user_id},
+            {"operation": "multiply", "operand_a": 3, "operand_b": 4, "user_id": 9999},
+            {"operation": "multiply", "operand_a": 3, "operand_b": 4, "user_id": user_id},
+        ],
+    )
+    assert response.status_code == 201
+    data = response.json()
+    assert len(data["created_ids"]) == 2
+    assert [e["index"] for e in data["errors"]] == [1, 2, 3]
+    assert data["errors"][0]["detail"] == "Division by zero is not allowed"
+
+    first, second = data["created_ids"]
+    assert client.get(f"/calculations/{first}").json()["result"] == 3
+    assert client.get(f"/calculations/{second}").json()["result"] == 12
+
+
+def test_batch_create_empty():
+    """Test batch creation with no items"""
+    response = client.post("/calculations/batch", json=[], headers=bearer(1))
+    assert response.status_code == 201
+    assert response.json() == {"created_ids": [], "errors": []}
+
+
+def test_import_ndjson():
+    """Test streaming NDJSON import with rejected rows"""
+    clear_db()
+    user_id = create_user()
+
+    body = "\n".join([
+        f'{{"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": {user_id}}}',
+        f'{{"operation": "divide", "operand_a": 1, "operand_b": 0, "user_id": {user_id}}}',
+        "not json",
+        "",
+        f'{{"operation": "multiply", "operand_a": 2, "operand_b": 5, "user_id": {user_id}, '
+        '"created_at": "2020-01-01T00:00:00"}',
+        '{"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": 9999}',
+    ])
+    response = client.post("/calculations/import?chunk_size=2", content=body)
+    assert response.status_code == 200
+    report = response.json()
+    assert report["imported"] == 2
+    assert report["rejected"] == 3
+    assert [r["line"] for r in report["rejections"]] == [2, 3, 6]
+
+    data = client.get("/calculations").json()
+    assert [c["result"] for c in data] == [10, 3]
+    assert data[0]["created_at"] == "2020-01-01T00:00:00"
+
+
+def test_import_csv():
+    """Test streaming CSV import"""
+    clear_db()
+    user_id = create_user()
+
+    body = (
+        "operation,operand_a,operand_b,user_id\n"
+        f"add,1,2,{user_id}\n"
+        f"subtract,5,x,{user_id}\n"
+        f"divide,9,3,{user_id}"
+    )
+    response = client.post("/calculations/import", content=body, headers={"content-type": "text/csv"})
+    assert response.status_code == 200
+    report = response.json()
+    assert report["imported"] == 2
+    assert report["rejected"] == 1
+    assert report["rejections"][0]["line"] == 3
+    assert len(client.get("/calculations").json()) == 2
+
+
+def login(email="calcuser@example.com", password="secret123"):
+    response = client.post("/users/login", json={"email": email, "password": password})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_token_authenticated_calculations():
+    """Test calculation routes resolve the user from an access token"""
+    clear_db()
+    user_id = create_user()
+    headers = login()
+
+    response = client.post(
+        "/calculations",
+        json={"operation": "add", "operand_a": 1, "operand_b": 2},
+        headers=headers,
+    )
+    assert response.status_code == 201
+    calc = response.json()
+    assert calc["user_id"] == user_id
+
+    response = client.post(
+        "/calculations",
+        json={"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id + 1},
+        headers=headers,
+    )
+    assert response.status_code == 403
+
+    response = client.get("/calculations", headers=headers)
+    assert [c["id"] for c in response.json()] == [calc["id"]]
+
+    response = client.put(f"/calculations/{calc['id']}", json={"operand_b": 5}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["result"] == 6
+
+
+def test_token_scopes_calculations_to_owner():
+    """Test an authenticated user cannot see another user's calculation"""
+    clear_db()
+    owner_id = create_user()
+    response = client.post(
+        "/calculations",
+        json={"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": owner_id},
+    )
+    calc_id = response.json()["id"]
+
+    response = client.post(
+        "/users/register",
+        json={"email": "other@example.com", "username": "otheruser", "password": "secret123"},
+    )
+    assert response.status_code == 201
+    headers = login("other@example.com")
+
+    assert client.get(f"/calculations/{calc_id}", headers=headers).status_code == 404
+    assert client.delete(f"/calculations/{calc_id}", headers=headers).status_code == 404
+    assert client.get(f"/calculations/{calc_id}").status_code == 200
+
+    client.headers.pop("Authorization")
+    assert client.get(f"/calculations/{calc_id}").status_code == 401
+    assert client.put(f"/calculations/{calc_id}", json={"operand_b": 5}).status_code == 401
+    assert client.delete(f"/calculations/{calc_id}").status_code == 401
+    assert client.get(f"/users/{owner_id}/stats").status_code == 401
+
+
+def test_anonymous_calculations_only_in_legacy_mode(monkeypatch):
+    """Test requests without a token are refused unless ANONYMOUS_CALCULATIONS is on"""
+    clear_db()
+    user_id = create_user()
+    client.headers.pop("Authorization")
+    payload = {"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id}
+
+    response = client.post("/calculations", json=payload)
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+    assert client.get("/calculations").status_code == 401
+    assert client.post("/calculations/import", content=json.dumps(payload)).status_code == 401
+
+    monkeypatch.setattr(auth, "ANONYMOUS_CALCULATIONS", True)
+    response = client.post("/calculations", json=payload)
+    assert response.status_code == 201
+    assert response.json()["user_id"] == user_id
+
+
+def test_invalid_token():
+    """Test a forged token is rejected"""
+    response = client.get("/calculations", headers={"Authorization": "Bearer not.a.token"})
+    assert response.status_code == 401
+
+    response = client.post("/calculations", json={"operation": "add", "operand_a": 1, "operand_b": 2})
+    assert response.status_code == 401
+
+
+def test_user_stats_maintained_on_writes():
+    """Test the stats summary follows add, batch, edit, delete and import"""
+    clear_db()
+    user_id = create_user()
+
+    response = client.get(f"/users/{user_id}/stats")
+    assert response.status_code == 200
+    assert response.json() == {"user_id": user_id, "total_count": 0, "operations": {}}
+
+    calc_id = client.post(
+        "/calculations",
+        json={"operation": "add", "operand_a": 2, "operand_b": 3, "user_id": user_id},
+    ).json()["id"]
+    client.post(
+        "/calculations/batch",
+        json=[
+            {"operation": "add", "operand_a": 1, "operand_b": 1, "user_id": user_id},
+            {"operation": "multiply", "operand_a": 2, "operand_b": 4, "user_id": user_id},
+        ],
+    )
+    client.post(
+        "/calculations/import",
+        content=f'{{"operation": "divide", "operand_a": 9, "operand_b": 3, "user_id": {user_id}}}',
+    )
+    client.put(f"/calculations/{calc_id}", json={"operation": "multiply"})
+
+    data = client.get(f"/users/{user_id}/stats").json()
+    assert data["total_count"] == 4
+    assert data["operations"] == {
+        "add": {"count": 1, "result_sum": 2},
+        "multiply": {"count": 2, "result_sum": 14},
+        "divide": {"count": 1, "result_sum": 3},
+    }
+
+    client.delete(f"/calculations/{calc_id}")
+    data = client.get(f"/users/{user_id}/stats").json()
+    assert data["total_count"] == 3
+    assert data["operations"]["multiply"] == {"count": 1, "result_sum": 8}
+
+    db = SessionLocal()
+    try:
+        assert stats.check_stats(db) == []
+        db.query(models.UserCalculationStats).delete()
+        db.commit()
+        assert len(stats.check_stats(db)) == 3
+        assert stats.rebuild_stats(db) == 3
+        assert stats.check_stats(db) == []
+    finally:
+        db.close()
+
+
+def test_stats_upsert_locks_rows_in_key_order():
+    """Test the stats upsert lists its rows sorted, whatever order the changes came in"""
+    delta = stats.StatsDelta()
+    delta.add(2, "add", 1)
+    delta.add(1, "multiply", 1)
+    delta.add(1, "add", 1)
+    params = delta.statement(engine.dialect.name).compile(dialect=engine.dialect).params
+    keys = [(params[f"user_id_m{i}"], params[f"operation_m{i}"]) for i in range(3)]
+    assert keys == [(1, "add"), (1, "multiply"), (2, "add")]
+
+
+def query_count(response):
+    """Number of SQL statements the request ran, from its Server-Timing header"""
+    db_timing = [entry for entry in response.headers["Server-Timing"].split(", ") if entry.startswith("db;")][0]
+    return int(db_timing.split('desc="')[1].split(" ")[0])
+
+
+def test_edit_and_delete_without_reading_first():
+    """Test edit and delete run no SELECT before writing and keep stats in step"""
+    clear_db()
+    user_id = create_user()
+    calc_id = client.post(
+        "/calculations",
+        json={"operation": "add", "operand_a": 2, "operand_b": 3, "user_id": user_id},
+    ).json()["id"]
+
+    response = client.put(f"/calculations/{calc_id}", json={"operation": "divide", "operand_b": 4})
+    assert response.status_code == 200
+    assert response.json()["result"] == 0.5
+    assert response.json()["operand_a"] == 2
+    if engine.dialect.name == "postgresql":
+        # UPDATE ... RETURNING (reading the old row too), stats change
+        assert query_count(response) == 2
+    else:
+        # stats removal, UPDATE ... RETURNING, stats addition
+        assert query_count(response) == 3
+
+    response = client.put(f"/calculations/{calc_id}", json={"operand_b": 0})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Division by zero is not allowed"
+    assert client.get(f"/calculations/{calc_id}").json()["operand_b"] == 4
+
+    response = client.delete(f"/calculations/{calc_id}")
+    assert response.status_code == 204
+    assert query_count(response) == 2
+
+    db = SessionLocal()
+    try:
+        assert stats.check_stats(db) == []
+    finally:
+        db.close()
+
+
+def test_edit_rejects_overflowing_result():
+    """Test an edit whose result overflows is rejected and leaves the row unchanged"""
+    clear_db()
+    user_id = create_user()
+    calc_id = client.post(
+        "/calculations",
+        json={"operation": "multiply", "operand_a": 1e308, "operand_b": 1, "user_id": user_id},
+    ).json()["id"]
+
+    response = client.put(f"/calculations/{calc_id}", json={"operand_b": 10})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Result is not a finite number"
+    assert client.get(f"/calculations/{calc_id}").json()["result"] == 1e308
+    assert client.get("/calculations").status_code == 200
+
+    db = SessionLocal()
+    try:
+        assert stats.check_stats(db) == []
+    finally:
+        db.close()
+
+
+def test_edit_scoped_to_owner():
+    """Test an authenticated user cannot edit another user's calculation"""
+    clear_db()
+    owner_id = create_user()
+    calc_id = client.post(
+        "/calculations",
+        json={"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": owner_id},
+    ).json()["id"]
+    client.post(
+        "/users/register",
+        json={"email": "other@example.com", "username": "otheruser", "password": "secret123"},
+    )
+    headers = login("other@example.com")
+
+    response = client.put(f"/calculations/{calc_id}", json={"operand_b": 0, "operation": "divide"}, headers=headers)
+    assert response.status_code == 404
+    assert client.get(f"/calculations/{calc_id}").json()["result"] == 3
+
+
+def test_user_stats_unknown_user():
+    """Test stats for a non-existent user"""
+    clear_db()
+    response = client.get("/users/9999/stats", headers=bearer(9999))
+    assert response.status_code == 404
+
+
+def test_fast_json_responses_match(monkeypatch):
+    """Test the orjson read path returns the same bodies and headers"""
+    clear_db()
+    user_id = create_user()
+    # A cached read would skip both serializers being compared.
+    monkeypatch.setattr(cache, "calculation_cache", cache.CalculationCache(None))
+    for i in range(3):
+        client.post(
+            "/calculations",
+            json={"operation": "divide", "operand_a": i, "operand_b": 3, "user_id": user_id},
+        )
+
+    browse = client.get("/calculations?limit=2")
+    calc_id = browse.json()[0]["id"]
+    read = client.get(f"/calculations/{calc_id}")
+
+    monkeypatch.setattr(main, "FAST_JSON_RESPONSES", True)
+    fast_browse = client.get("/calculations?limit=2")
+    fast_read = client.get(f"/calculations/{calc_id}")
+
+    assert fast_browse.json() == browse.json()
+    assert fast_browse.headers["X-Next-Cursor"] == browse.headers["X-Next-Cursor"]
+    assert fast_read.json() == read.json()
+    assert query_count(fast_read) == 1
+    assert client.get("/calculations/9999").status_code == 404
+
+
+def test_import_scoped_to_token_owner(monkeypatch):
+    """Test a token caller imports only their own rows"""
+    clear_db()
+    user_id = create_user()
+    other = SessionLocal()
+    other_user = models.User(email="other-import@example.com", username="otherimport", hashed_password="x")
+    other.add(other_user)
+    other.commit()
+    other_id = other_user.id
+    other.close()
+    headers = login()
+
+    body = "\n".join([
+        '{"operation": "add", "operand_a": 1, "operand_b": 2}',
+        f'{{"operation": "add", "operand_a": 3, "operand_b": 4, "user_id": {user_id}}}',
+        f'{{"operation": "add", "operand_a": 5, "operand_b": 6, "user_id": {other_id}}}',
+    ])
+    report = client.post("/calculations/import", content=body, headers=headers).json()
+    assert report["imported"] == 2
+    assert report["rejections"] == [{"line": 3, "detail": "Cannot act on behalf of another user"}]
+    assert {c["user_id"] for c in client.get("/calculations").json()} == {user_id}
+
+    monkeypatch.setattr(auth, "ANONYMOUS_CALCULATIONS", True)
+    client.headers.pop("Authorization")
+    report = client.post("/calculations/import", content='{"operation": "add", "operand_a": 1, "operand_b": 2}').json()
+    assert report["rejections"][0]["detail"] == "user_id: Field required"
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from app.main import app
+from app.database import Base, engine, SessionLocal
+from app import auth, exporter, models
+
+client = TestClient(app)
+# Exports are scoped to the caller; every seeded row belongs to user 1.
+client.headers["Authorization"] = f"Bearer {auth.create_access_token(1)}"
+
+ROWS = 12000
+START = datetime(2024, 1, 1)
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
+    db.query(models.Calculation).delete()
+    db.query(models.User).delete()
+    db.execute(insert(models.User), [
+        {"id": 1, "email": "export1@example.com", "username": "export1", "hashed_password": "x"},
+        {"id": 2, "email": "export2@example.com", "username": "export2", "hashed_password": "x"},
+    ])
+    operations = ["add", "subtract", "multiply", "divide"]
+    db.execute(insert(models.Calculation), [
+        {"operation": operations[i % 4], "operand_a": i, "operand_b": 1, "result": i, "user_id": 1,
+         "created_at": START + timedelta(seconds=i)}
+        for i in range(ROWS)
+    ])
+    db.commit()
+    db.close()
+
+
+def teardown_module():
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_export_ndjson():
+    """Test the full table streams as NDJSON in browse order"""
+    response = client.get("/calculations/export", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "content-encoding" not in response.headers
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == ROWS
+    assert rows[0]["operand_a"] == 0 and rows[-1]["operand_a"] == ROWS - 1
+    assert set(rows[0]) == set(exporter.COLUMNS)
+
+
+def test_export_csv_with_filters():
+    """Test the browse filters apply to CSV exports"""
+    response = client.get(
+        "/calculations/export",
+        params={
+            "format": "csv",
+            "operation": "divide",
+            "user_id": 1,
+            "created_after": (START + timedelta(seconds=100)).isoformat(),
+            "created_before": (START + timedelta(seconds=200)).isoformat(),
+        },
+    )
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 25
+    assert {row["operation"] for row in rows} == {"divide"}
+    assert {row["user_id"] for row in rows} == {"1"}
+
+
+def test_export_scoped_to_caller():
+    """Test a caller exports only their own calculations"""
+    response = client.get("/calculations/export", headers={"Authorization": f"Bearer {auth.create_access_token(2)}"})
+    assert response.status_code == 200
+    assert response.text == ""
+    assert client.get("/calculations/export", params={"user_id": 2}).status_code == 403
+
+
+def test_export_gzip():
+    """Test the body is gzipped when the client accepts it"""
+    response = client.get("/calculations/export", params={"operation": "add"}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert len(response.text.splitlines()) == ROWS // 4
+
+
+def test_export_arrow_in_batches():
+    """Test Arrow exports are an IPC stream with one record batch per chunk"""
+    pa = pytest.importorskip("pyarrow")
+    response = client.get("/calculations/export", params={"format": "arrow"})
+    assert response.status_code == 200
+    reader = pa.ipc.open_stream(response.content)
+    batches = list(reader)
+    assert len(batches) == -(-ROWS // exporter.DEFAULT_CHUNK_SIZE)
+    table = pa.Table.from_batches(batches)
+    assert table.num_rows == ROWS
+    assert table.schema.field("created_at").type == pa.timestamp("us")
+    assert table.column("result").to_pylist()[:3] == [0.0, 1.0, 2.0]
+
+
+def test_export_rejects_unknown_format():
+    """Test an unsupported format is a validation error"""
+    assert client.get("/calculations/export", params={"format": "xml"}).status_code == 422
@@ -0,0 +1,44 @@
+import pytest
+from app.expressions import compile_expression, ExpressionError
+
+
+def test_evaluate_expression():
+    plan = compile_expression("(a + b) * c / d")
+    assert plan.variables == ("a", "b", "c", "d")
+    assert plan({"a": 1, "b": 2, "c": 4, "d": 3}) == 4
+    assert plan({"a": -1, "b": 1, "c": 4, "d": 2}) == 0
+
+
+def test_constants_and_unary():
+    assert compile_expression("-2 * +3 - 1.5")({}) == -7.5
+
+
+def test_plan_cache():
+    assert compile_expression("x * 2") is compile_expression("x * 2")
+
+
+def test_division_by_zero():
+    with pytest.raises(ValueError):
+        compile_expression("a / (b - b)")({"a": 1, "b": 2})
+
+
+def test_missing_variable():
+    with pytest.raises(ValueError):
+        compile_expression("a + b")({"a": 1})
+
+
+@pytest.mark.parametrize("text", [
+    "__import__('os').system('true')",
+    "a ** 2",
+    "a.real",
+    "[1, 2]",
+    "a if b else c",
+    "'text'",
+    "True + 1",
+    "a +",
+    "(" * 500 + "1" + ")" * 500,
+    "9" * 400,
+])
+def test_rejects_unsafe_or_invalid(text):
+    with pytest.raises(ExpressionError):
+        compile_expression(text)
@@ -0,0 +1,129 @@
+import json
+import os
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.database import Base, engine, SessionLocal
+from app.metrics import Registry
+from app import auth, models
+
+client = TestClient(app)
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+
+
+def teardown_module():
+    Base.metadata.drop_all(bind=engine)
+
+
+def scrape():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_requests_labelled_by_route_template():
+    """Test request counts and latencies use the route template, not the raw path"""
+    headers = {"Authorization": f"Bearer {auth.create_access_token(1)}"}
+    client.get("/calculations/123456", headers=headers)
+    client.get("/calculations/654321", headers=headers)
+    samples = scrape()
+    key = 'http_requests_total{method="GET",route="/calculations/{calculation_id}",status="404"}'
+    assert samples[key] >= 2
+    assert not any("/calculations/123456" in name for name in samples)
+    count = 'http_request_duration_seconds_count{method="GET",route="/calculations/{calculation_id}"}'
+    assert samples[count] >= 2
+
+
+def test_unmatched_paths_share_one_label():
+    """Test unknown paths do not create new label values"""
+    client.get("/no/such/path")
+    samples = scrape()
+    assert samples['http_requests_total{method="GET",route="<unmatched>",status="404"}'] >= 1
+
+
+def test_pool_hashing_and_in_flight_metrics():
+    """Test pool, hashing and in-flight families are exposed"""
+    client.get("/calculations", headers={"Authorization": f"Bearer {auth.create_access_token(1)}"})
+    text = client.get("/metrics").text
+    assert 'db_pool_checkouts_total{engine="async"}' in text
+    assert "# TYPE db_pool_checkout_seconds histogram" in text
+    assert "# TYPE password_hash_seconds histogram" in text
+    assert "password_hash_queue_depth 0.0" in text
+    # The scrape itself is in flight while the body is rendered.
+    assert 'http_requests_in_flight{method="GET"} 1.0' in text
+
+
+def test_calculations_counted_by_operation():
+    """Test created calculations are counted by operation"""
+    db = SessionLocal()
+    user = models.User(email="metrics@example.com", username="metrics", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+
+    headers = {"Authorization": f"Bearer {auth.create_access_token(user_id)}"}
+    before = scrape().get('calculations_created_total{operation="multiply"}', 0)
+    client.post("/calculations", json={"operation": "multiply", "operand_a": 2, "operand_b": 3, "user_id": user_id},
+                headers=headers)
+    client.post("/calculations/batch", headers=headers, json=[
+        {"operation": "multiply", "operand_a": 1, "operand_b": 1, "user_id": user_id},
+        {"operation": "divide", "operand_a": 1, "operand_b": 0, "user_id": user_id},
+    ])
+    assert scrape()['calculations_created_total{operation="multiply"}'] == before + 2
+
+
+def test_multiprocess_merge(tmp_path):
+    """Test a scrape merges other workers' snapshots and drops dead workers' gauges"""
+    registry = Registry(multiproc_dir=str(tmp_path))
+    requests = registry.counter("jobs_total", "Jobs.", ("kind",))
+    busy = registry.gauge("jobs_busy", "Busy workers.")
+    requests.inc("a")
+    busy.inc()
+
+    def snapshot(pid, jobs, busy_workers):
+        families = [
+            {"name": "jobs_total", "type": "counter", "help": "Jobs.", "samples": [["jobs_total", {"kind": "a"}, jobs]]},
+            {"name": "jobs_busy", "type": "gauge", "help": "Busy workers.", "samples": [["jobs_busy", {}, busy_workers]]},
+        ]
+        (tmp_path / f"metrics-{pid}.json").write_text(json.dumps(families))
+
+    snapshot(os.getppid(), 2, 1)  # a live process
+    snapshot(2 ** 22 + 1, 4, 1)  # above the default pid_max, so never alive
+
+    text = registry.render()
+    assert 'jobs_total{kind="a"} 7.0' in text
+    assert "jobs_busy 2.0" in text
+
+    # The dead worker's counters now live in the aggregate file only.
+    assert not (tmp_path / f"metrics-{2 ** 22 + 1}.json").exists()
+    assert registry.render() == text
+    snapshot(2 ** 22 + 2, 8, 1)
+    assert 'jobs_total{kind="a"} 15.0' in registry.render()
+    assert {path.name for path in tmp_path.glob("*.json")} == {"metrics-exited.json", f"metrics-{os.getppid()}.json"}
+
+    registry.write_snapshot()
+    assert (tmp_path / f"metrics-{os.getpid()}.json").exists()
+
+
+def test_reused_pid_keeps_exited_totals(tmp_path):
+    """Test a worker whose pid was used before does not overwrite that process's counters"""
+    registry = Registry(multiproc_dir=str(tmp_path))
+    registry.counter("jobs_total", "Jobs.").inc(amount=1)
+    families = [{"name": "jobs_total", "type": "counter", "help": "Jobs.", "samples": [["jobs_total", {}, 5]]}]
+    (tmp_path / f"metrics-{os.getpid()}.json").write_text(json.dumps(families))
+
+    registry.write_snapshot()
+    assert "jobs_total 6.0" in registry.render()
+    registry.write_snapshot()
+    assert "jobs_total 6.0" in registry.render()
@@ -1,5 +1,15 @@
 import pytest
-from app.operations import add, subtract, multiply, divide
+from app.operations import (
+    add,
+    subtract,
+    multiply,
+    divide,
+    calculate,
+    vector_calculate,
+    VECTOR_OK,
+    VECTOR_INVALID_OPERATION,
+    VECTOR_DIVISION_BY_ZERO,
+)
 
 
 def test_add():
@@ -29,3 +39,37 @@ def test_divide():
 def test_divide_by_zero():
     with pytest.raises(ValueError):
         divide(10, 0)
+
+
+def test_calculate():
+    assert calculate("add", 2, 3) == 5
+    assert calculate("divide", 9, 3) == 3
+    with pytest.raises(ValueError):
+        calculate("modulo", 1, 2)
+    with pytest.raises(ValueError):
+        calculate("divide", 1, 0)
+
+
+def test_vector_calculate_single_operation():
+    results, errors = vector_calculate("divide", [10, 9, 1], [2, 3, 0])
+    assert results[:2].tolist() == [5, 3]
+    assert errors.tolist() == [VECTOR_OK, VECTOR_OK, VECTOR_DIVISION_BY_ZERO]
+
+
+def test_vector_calculate_mixed_operations():
+    results, errors = vector_calculate(
+        ["add", "subtract", "multiply", "divide", "modulo"],
+        [1, 5, 2, 8, 1],
+        [2, 3, 4, 2, 1],
+    )
+    assert results[:4].tolist() == [3, 2, 8, 4]
+    assert errors.tolist() == [0, 0, 0, 0, VECTOR_INVALID_OPERATION]
+
+
+def test_vector_calculate_invalid_input():
+    with pytest.raises(ValueError):
+        vector_calculate("modulo", [1], [2])
+    with pytest.raises(ValueError):
+        vector_calculate("add", [1, 2], [2])
+    with pytest.raises(ValueError):
+        vector_calculate(["add"], [1, 2], [2, 3])
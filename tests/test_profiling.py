@@ -0,0 +1,72 @@
+import logging
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import auth
+from app.main import app
+from app.database import Base, engine
+from app.profiling import ProfiledRoute, ProfilingMiddleware
+
+client = TestClient(app)
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+
+
+def teardown_module():
+    Base.metadata.drop_all(bind=engine)
+
+
+def server_timing(response):
+    metrics = {}
+    for entry in response.headers["Server-Timing"].split(", "):
+        name, *params = entry.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+def test_server_timing_header():
+    """Test every response reports total, db, serialize and hash timings"""
+    response = client.get("/calculations", headers={"Authorization": f"Bearer {auth.create_access_token(1)}"})
+    assert response.status_code == 200
+    metrics = server_timing(response)
+    assert set(metrics) == {"total", "db", "serialize", "hash"}
+    assert metrics["db"]["desc"] == '"1 queries"'
+    assert float(metrics["total"]["dur"]) >= float(metrics["db"]["dur"])
+
+
+def test_server_timing_without_database():
+    """Test requests that do not touch the database report zero queries"""
+    response = client.get("/api/add?a=1&b=2")
+    assert server_timing(response)["db"]["desc"] == '"0 queries"'
+
+
+def test_request_log_line(caplog):
+    """Test the structured log line for a request"""
+    with caplog.at_level(logging.INFO, logger="app.profiling"):
+        client.get("/api/add?a=1&b=3")
+    record = [r for r in caplog.records if r.name == "app.profiling"][-1]
+    assert '"path": "/api/add"' in record.getMessage()
+    assert '"status": 200' in record.getMessage()
+
+
+def test_slow_request_profile(tmp_path):
+    """Test slow requests dump folded stacks"""
+    slow_app = FastAPI()
+    slow_app.router.route_class = ProfiledRoute
+
+    @slow_app.get("/slow")
+    def slow():
+        time.sleep(0.1)
+        return {"ok": True}
+
+    slow_app.add_middleware(ProfilingMiddleware, slow_ms=50, sample_interval_ms=1, output_dir=str(tmp_path))
+    response = TestClient(slow_app).get("/slow")
+    assert response.status_code == 200
+
+    dumps = list(tmp_path.glob("*-GET-slow.folded"))
+    assert len(dumps) == 1
+    assert ":slow:" in dumps[0].read_text()
@@ -0,0 +1,124 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, text
+
+from app.main import _browse_query, _user_stats_query
+from app.database import Base, engine, SessionLocal
+from app import models
+
+SEED_USERS = 20
+SEED_CALCULATIONS = 5000
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
+    db.query(models.Calculation).delete()
+    db.query(models.User).delete()
+    db.execute(insert(models.User), [
+        {"id": i, "email": f"plan{i}@example.com", "username": f"plan{i}", "hashed_password": "x"}
+        for i in range(1, SEED_USERS + 1)
+    ])
+    start = datetime(2024, 1, 1)
+    operations = ["add", "subtract", "multiply", "divide"]
+    db.execute(insert(models.Calculation), [
+        {
+            "operation": operations[i % 4],
+            "operand_a": i,
+            "operand_b": 1,
+            "result": i,
+            "user_id": i % SEED_USERS + 1,
+            "created_at": start + timedelta(minutes=i),
+        }
+        for i in range(SEED_CALCULATIONS)
+    ])
+    db.commit()
+    if engine.dialect.name == "sqlite":
+        db.execute(text("ANALYZE"))
+    else:
+        db.execute(text("ANALYZE calculations"))
+    db.commit()
+    db.close()
+
+
+def teardown_module():
+    Base.metadata.drop_all(bind=engine)
+
+
+def full_scans(stmt, allow_ordered_scan=False):
+    """Return the plan steps that read a table (or a whole index) in full, or sort.
+
+    ``allow_ordered_scan`` accepts walking an index in order, which is how an
+    unfiltered keyset page is served: the LIMIT stops the walk early.
+    """
+    db = SessionLocal()
+    try:
+        compiled = stmt.compile(dialect=engine.dialect)
+        connection = db.connection()
+        if engine.dialect.name == "sqlite":
+            params = tuple(compiled.params[name] for name in compiled.positiontup)
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+            steps = [row[-1] for row in rows]
+            return [
+                step for step in steps
+                if "TEMP B-TREE" in step
+                or step.startswith("SCAN") and ("USING" not in step or not allow_ordered_scan)
+            ]
+
+        # With sequential scans disabled the planner still falls back to one
+        # when no index can serve the query, so any Seq Scan left is a miss.
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        found = []
+        nodes = [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            node_type = node["Node Type"]
+            # "Incremental Sort" counts too: the index covered only part
+            # of the keyset order.
+            if node_type == "Seq Scan" or node_type.endswith("Sort"):
+                found.append(f"{node_type} {node.get('Relation Name', '')}".strip())
+            elif node_type in ("Index Scan", "Index Only Scan") and "Index Cond" not in node and not allow_ordered_scan:
+                found.append(f"{node_type} {node['Index Name']} without an index condition")
+            nodes.extend(node.get("Plans", []))
+        return found
+    finally:
+        db.rollback()
+        db.close()
+
+
+def test_browse_uses_indexes():
+    """Test every browse filter is served by an index in keyset order"""
+    cursor = (datetime(2024, 1, 2), 1500)
+    since = datetime(2024, 1, 2)
+    assert full_scans(_browse_query(100), allow_ordered_scan=True) == []
+
+    queries = [
+        _browse_query(100, after=cursor),
+        _browse_query(100, user_id=3),
+        _browse_query(100, user_id=3, after=cursor),
+        _browse_query(100, operation="divide"),
+        _browse_query(100, created_after=since, created_before=since + timedelta(hours=1)),
+    ]
+    for query in queries:
+        assert full_scans(query) == [], str(query)
+
+
+def test_read_uses_primary_key():
+    """Test reading a calculation by id is an index lookup"""
+    query = select(models.Calculation).where(models.Calculation.id == 42)
+    assert full_scans(query) == []
+
+
+def test_stats_uses_primary_key():
+    """Test reading user stats is an index lookup"""
+    assert full_scans(_user_stats_query(3)) == []
+
+
+def test_user_cascade_delete_uses_index():
+    """Test deleting a user's calculations does not scan the table"""
+    query = delete(models.Calculation).where(models.Calculation.user_id == 3)
+    assert full_scans(query) == []
@@ -0,0 +1,107 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+
+from app.main import app
+from app.database import Base, engine, SessionLocal, ReplicaRouter, async_engine
+from app import auth, cache, database, models
+
+client = TestClient(app)
+
+REPLICA_ONLY_ID = 999999
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+
+
+def teardown_module():
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def separate_pool_stats(monkeypatch):
+    """Keep the test replicas out of the application's pool report, and send every read to the database"""
+    monkeypatch.setattr(database, "pool_stats", dict(database.pool_stats))
+    monkeypatch.setattr(cache, "calculation_cache", cache.CalculationCache(None))
+
+
+def clear_db():
+    db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
+    db.query(models.Calculation).delete()
+    db.query(models.User).delete()
+    db.commit()
+    db.close()
+
+
+def make_replica(path, result, user_id=1):
+    """Create a SQLite replica holding one calculation the primary does not have."""
+    replica = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=replica)
+    with replica.begin() as connection:
+        connection.execute(insert(models.User), [{"id": user_id, "email": "r@example.com", "username": "r", "hashed_password": "x"}])
+        connection.execute(insert(models.Calculation), [{
+            "id": REPLICA_ONLY_ID, "operation": "add", "operand_a": result, "operand_b": 0,
+            "result": result, "user_id": user_id, "created_at": datetime(2024, 1, 1),
+        }])
+    replica.dispose()
+    return f"sqlite:///{path}"
+
+
+def bearer(user_id):
+    return {"Authorization": f"Bearer {auth.create_access_token(user_id)}"}
+
+
+def read_replica_row(user_id=1):
+    return client.get(f"/calculations/{REPLICA_ONLY_ID}", headers=bearer(user_id))
+
+
+def test_reads_rotate_over_replicas(tmp_path, monkeypatch):
+    """Test GET routes are served by the replicas in turn"""
+    clear_db()
+    router = ReplicaRouter(async_engine, [make_replica(tmp_path / "r0.db", 10), make_replica(tmp_path / "r1.db", 20)])
+    monkeypatch.setattr(database, "read_router", router)
+
+    results = [read_replica_row().json()["result"] for _ in range(4)]
+    assert results == [10, 20, 10, 20]
+    assert router.snapshot()["replica_reads"] == [2, 2]
+
+
+def test_reads_stick_to_primary_after_a_write(tmp_path, monkeypatch):
+    """Test a client's reads go to the primary right after it writes"""
+    clear_db()
+    db = SessionLocal()
+    user = models.User(email="sticky@example.com", username="sticky", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    router = ReplicaRouter(async_engine, [make_replica(tmp_path / "r0.db", 10, user_id)], sticky_seconds=60)
+    monkeypatch.setattr(database, "read_router", router)
+    assert read_replica_row(user_id).status_code == 200
+
+    created = client.post("/calculations", json={"operation": "add", "operand_a": 1, "operand_b": 1},
+                          headers=bearer(user_id))
+    assert created.status_code == 201
+
+    assert read_replica_row(user_id).status_code == 404
+    assert client.get(f"/calculations/{created.json()['id']}", headers=bearer(user_id)).status_code == 200
+    assert router.snapshot()["primary_reads"] == 2
+
+
+def test_unreachable_replica_falls_back_to_primary(tmp_path, monkeypatch):
+    """Test a replica that cannot be reached is skipped"""
+    clear_db()
+    missing = f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"
+    router = ReplicaRouter(async_engine, [missing], retry_seconds=60)
+    monkeypatch.setattr(database, "read_router", router)
+
+    assert read_replica_row().status_code == 404
+    assert read_replica_row().status_code == 404
+    snapshot = router.snapshot()
+    assert snapshot["fallbacks"] == 1
+    assert snapshot["down"] == [0]
+    assert snapshot["primary_reads"] == 2
@@ -0,0 +1,34 @@
+from app import server
+
+
+def test_options_from_environment():
+    """Test the launcher reads its settings from the environment"""
+    options = server.build_options({
+        "WEB_CONCURRENCY": "3",
+        "PORT": "9000",
+        "GRACEFUL_TIMEOUT": "15",
+        "MAX_REQUESTS": "500",
+        "MAX_REQUESTS_JITTER": "50",
+        "PRELOAD_APP": "false",
+    })
+    assert options["workers"] == 3
+    assert options["bind"] == "0.0.0.0:9000"
+    assert options["graceful_timeout"] == 15
+    assert options["max_requests"] == 500
+    assert options["max_requests_jitter"] == 50
+    assert options["preload_app"] is False
+    assert options["worker_class"] == "uvicorn.workers.UvicornWorker"
+
+
+def test_default_workers_follow_available_cpus():
+    """Test the default worker count is the number of usable CPUs"""
+    options = server.build_options({})
+    assert options["workers"] == server.available_cpus() >= 1
+    assert options["preload_app"] is True
+
+
+def test_config_is_accepted_by_gunicorn():
+    """Test every option is a valid gunicorn setting"""
+    application = server.Server(server.build_options({"WEB_CONCURRENCY": "2"}))
+    assert application.cfg.workers == 2
+    assert application.cfg.worker_class_str == server.WORKER_CLASS
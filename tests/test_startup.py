@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import auth
+from app.main import app
+from app.database import pool_stats
+
+
+def test_lifespan_warms_pools_and_reports_startup():
+    """Test startup opens pool connections and reports its timings"""
+    connects = pool_stats["async"].connects
+    with TestClient(app) as client:
+        report = client.get("/health/startup").json()
+    assert report["pools_warmed"] is True
+    assert report["warmup_ms"] >= 0
+    assert report["ready_after_ms"] is None or report["ready_after_ms"] >= report["warmup_ms"]
+    assert pool_stats["async"].connects > connects
+
+
+def test_import_runs_no_ddl(tmp_path):
+    """Test importing the application does not create tables"""
+    database = tmp_path / "fresh.db"
+    code = "import app.main; import sqlalchemy as sa; print(sa.inspect(app.database.engine).get_table_names())"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        env={"DATABASE_URL": f"sqlite:///{database}", "PATH": ""},
+        capture_output=True, text=True, check=True,
+    )
+    assert output.stdout.strip() == "[]"
+
+
+def test_startup_requires_a_signing_key(monkeypatch):
+    """Test the application refuses to start without JWT_SECRET_KEY"""
+    monkeypatch.setattr(auth, "JWT_SECRET_KEY", None)
+    with pytest.raises(RuntimeError, match="JWT_SECRET_KEY"):
+        with TestClient(app):
+            pass
@@ -1,7 +1,11 @@
+import asyncio
+import threading
+
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 from app.database import Base, engine, SessionLocal
-from app import models
+from app import models, auth
 
 client = TestClient(app)
 
@@ -16,6 +20,7 @@ def teardown_module():
 
 def clear_db():
     db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
     db.query(models.Calculation).delete()
     db.query(models.User).delete()
     db.commit()
@@ -50,6 +55,8 @@ def test_user_register_and_login():
     login_data = response.json()
     assert login_data["id"] == user_id
     assert login_data["email"] == "test@example.com"
+    assert login_data["token_type"] == "bearer"
+    assert auth.decode_access_token(login_data["access_token"]) == user_id
 
 
 def test_login_invalid_password():
@@ -98,6 +105,7 @@ def test_duplicate_email():
         },
     )
     assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
 
 
 def test_duplicate_username():
@@ -123,6 +131,32 @@ def test_duplicate_username():
         },
     )
     assert response.status_code == 400
+    assert response.json()["detail"] == "Username already taken"
+
+
+def test_duplicate_message_follows_the_constraint():
+    """Test the duplicate message comes from the violated constraint, not the values"""
+    from sqlalchemy.exc import IntegrityError
+    from app.main import _violated_constraint
+
+    class Driver(Exception):
+        constraint_name = "ix_users_username"
+
+    cause = Driver()
+    wrapped = Exception('duplicate key value violates unique constraint "ix_users_username"\n'
+                        'DETAIL:  Key (username)=(emailfan) already exists.')
+    wrapped.__cause__ = cause
+    assert _violated_constraint(IntegrityError("INSERT", {}, wrapped)) == "ix_users_username"
+    wrapped.__cause__ = None
+    assert _violated_constraint(IntegrityError("INSERT", {}, wrapped)) == "ix_users_username"
+    message = Exception("UNIQUE constraint failed: users.email")
+    assert _violated_constraint(IntegrityError("INSERT", {}, message)).endswith("email")
+
+    clear_db()
+    payload = {"email": "fan1@example.com", "username": "emailfan", "password": "password123"}
+    assert client.post("/users/register", json=payload).status_code == 201
+    response = client.post("/users/register", json={**payload, "email": "fan2@example.com"})
+    assert response.json()["detail"] == "Username already taken"
 
 
 def test_login_nonexistent_user():
@@ -137,3 +171,47 @@ def test_login_nonexistent_user():
         },
     )
     assert response.status_code == 401
+
+
+def test_hash_executor_rejects_when_full():
+    """Test the hashing executor sheds work beyond its queue"""
+    executor = auth.HashExecutor(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def run():
+        first = asyncio.ensure_future(executor.submit(release.wait))
+        second = asyncio.ensure_future(executor.submit(release.wait))
+        await asyncio.sleep(0)
+        assert executor.pending == 2
+        with pytest.raises(auth.HashQueueFull):
+            await executor.submit(release.wait)
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(run())
+    assert executor.pending == 0
+    assert executor.rejected == 1
+    assert executor.hash_latency.count == 2
+
+
+def test_hashing_busy_returns_503(monkeypatch):
+    """Test register returns 503 with Retry-After when hashing is saturated"""
+    clear_db()
+    monkeypatch.setattr(auth.hash_executor, "capacity", 0)
+
+    response = client.post(
+        "/users/register",
+        json={
+            "email": "busy@example.com",
+            "username": "busyuser",
+            "password": "secret123",
+        },
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_hashing_health():
+    response = client.get("/health/hashing")
+    assert response.status_code == 200
+    assert response.json()["queue_depth"] == 0
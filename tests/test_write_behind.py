@@ -0,0 +1,205 @@
+import time
+from collections import deque
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.database import Base, engine, SessionLocal
+from app import auth, cache, models, stats, write_behind
+
+
+def setup_module():
+    Base.metadata.create_all(bind=engine)
+
+
+def teardown_module():
+    Base.metadata.drop_all(bind=engine)
+
+
+def clear_db():
+    db = SessionLocal()
+    db.query(models.UserCalculationStats).delete()
+    db.query(models.Calculation).delete()
+    db.query(models.User).delete()
+    db.commit()
+    db.close()
+    # Rows were removed behind the cache's back.
+    cache.calculation_cache = cache.CalculationCache(cache.MemoryBackend())
+
+
+def create_user():
+    db = SessionLocal()
+    user = models.User(email="behind@example.com", username="behind", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return user_id
+
+
+def bearer(user_id):
+    return {"Authorization": f"Bearer {auth.create_access_token(user_id)}"}
+
+
+# Write-behind only starts where ids can be reserved from a sequence.
+requires_sequences = pytest.mark.skipif(
+    engine.dialect.name not in write_behind.SEQUENCE_DIALECTS,
+    reason=f"write-behind does not start on {engine.dialect.name}",
+)
+
+
+def count_calculations():
+    db = SessionLocal()
+    try:
+        return db.query(models.Calculation).count()
+    finally:
+        db.close()
+
+
+@requires_sequences
+def test_writes_are_queued_and_flushed_on_shutdown(monkeypatch):
+    """Test queued calculations get their ids at once and are written by shutdown"""
+    clear_db()
+    user_id = create_user()
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND", True)
+    monkeypatch.setattr(write_behind.writer, "flush_interval", 60)
+
+    with TestClient(app) as client:
+        client.headers.update(bearer(user_id))
+        responses = [
+            client.post("/calculations", json={"operation": "add", "operand_a": i, "operand_b": 1, "user_id": user_id})
+            for i in range(5)
+        ]
+        assert [r.status_code for r in responses] == [202] * 5
+        ids = [r.json()["id"] for r in responses]
+        assert len(set(ids)) == 5
+        assert responses[2].json()["result"] == 3
+        assert count_calculations() == 0
+
+    assert count_calculations() == 5
+    db = SessionLocal()
+    assert stats.check_stats(db) == []
+    assert db.get(models.Calculation, ids[4]).result == 5
+    db.close()
+    snapshot = write_behind.writer.snapshot()
+    assert snapshot["pending"] == 0 and snapshot["running"] is False
+
+
+@requires_sequences
+def test_time_trigger_flushes_without_shutdown(monkeypatch):
+    """Test the background task writes the queue after the flush interval"""
+    clear_db()
+    user_id = create_user()
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND", True)
+    monkeypatch.setattr(write_behind.writer, "flush_interval", 0.01)
+
+    with TestClient(app) as client:
+        client.headers.update(bearer(user_id))
+        response = client.post("/calculations", json={"operation": "multiply", "operand_a": 6, "operand_b": 7, "user_id": user_id})
+        assert response.status_code == 202
+        for _ in range(100):
+            if client.get(f"/calculations/{response.json()['id']}").status_code == 200:
+                break
+            time.sleep(0.01)
+        assert client.get(f"/calculations/{response.json()['id']}").json()["result"] == 42
+
+
+@requires_sequences
+def test_full_queue_returns_503(monkeypatch):
+    """Test backpressure once the queue is full"""
+    clear_db()
+    user_id = create_user()
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND", True)
+    monkeypatch.setattr(write_behind.writer, "flush_interval", 60)
+    monkeypatch.setattr(write_behind.writer, "max_pending", 2)
+
+    with TestClient(app) as client:
+        client.headers.update(bearer(user_id))
+        payload = {"operation": "add", "operand_a": 1, "operand_b": 1, "user_id": user_id}
+        assert client.post("/calculations", json=payload).status_code == 202
+        assert client.post("/calculations", json=payload).status_code == 202
+        response = client.post("/calculations", json=payload)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    assert count_calculations() == 2
+
+
+def test_synchronous_writes_when_disabled():
+    """Test the endpoint commits before answering when write-behind is off"""
+    clear_db()
+    user_id = create_user()
+    with TestClient(app) as client:
+        client.headers.update(bearer(user_id))
+        response = client.post("/calculations", json={"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id})
+    assert response.status_code == 201
+    assert count_calculations() == 1
+
+
+@pytest.mark.skipif(engine.dialect.name != "sqlite", reason="checks the SQLite fallback")
+def test_sqlite_falls_back_to_synchronous_writes(monkeypatch):
+    """Test write-behind does not start on SQLite, whose ids other routes may take"""
+    clear_db()
+    user_id = create_user()
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND", True)
+    with TestClient(app) as client:
+        client.headers.update(bearer(user_id))
+        payload = {"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id}
+        first = client.post("/calculations", json=payload)
+        batch = client.post("/calculations/batch", json=[payload])
+        assert first.status_code == 201
+        assert batch.json()["created_ids"] == [first.json()["id"] + 1]
+        health = client.get("/health/write-behind").json()
+        assert health["running"] is False
+        assert "sqlite" in health["disabled_reason"]
+    assert count_calculations() == 2
+
+
+@requires_sequences
+def test_reserved_ids_do_not_collide_with_other_inserts(monkeypatch):
+    """Test ids reserved from the sequence are never taken by synchronous inserts"""
+    clear_db()
+    user_id = create_user()
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND", True)
+    monkeypatch.setattr(write_behind.writer, "flush_interval", 60)
+    monkeypatch.setattr(write_behind.writer.ids, "block_size", 10)
+    monkeypatch.setattr(write_behind.writer.ids, "_ids", deque())
+
+    with TestClient(app) as client:
+        client.headers.update(bearer(user_id))
+        payload = {"operation": "add", "operand_a": 1, "operand_b": 2, "user_id": user_id}
+        queued = client.post("/calculations", json=payload).json()["id"]
+        created = client.post("/calculations/batch", json=[payload] * 3).json()["created_ids"]
+        assert min(created) > queued + 9
+    assert count_calculations() == 4
+
+
+@requires_sequences
+def test_flusher_survives_unexpected_errors(monkeypatch):
+    """Test an unexpected flush error keeps the rows queued and the flusher running"""
+    clear_db()
+    user_id = create_user()
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND", True)
+    monkeypatch.setattr(write_behind.writer, "flush_interval", 0.01)
+    real_write = write_behind.writer._write
+    calls = []
+
+    async def flaky_write(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        await real_write(rows)
+
+    monkeypatch.setattr(write_behind.writer, "_write", flaky_write)
+    with TestClient(app) as client:
+        client.headers.update(bearer(user_id))
+        response = client.post("/calculations", json={"operation": "add", "operand_a": 2, "operand_b": 2, "user_id": user_id})
+        assert response.status_code == 202
+        for _ in range(100):
+            if count_calculations():
+                break
+            time.sleep(0.01)
+        assert write_behind.writer.running
+    assert count_calculations() == 1
+    snapshot = write_behind.writer.snapshot()
+    assert snapshot["retries"] >= 1 and snapshot["failed"] == 0